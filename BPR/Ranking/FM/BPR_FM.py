@@ -4,16 +4,30 @@
 # In[ ]:
 
 
+import json
+import os
+import sys
 import pandas as pd
 import numpy as np
-from math import ceil
 
-class BPR():
+# the parts of the training shared with the MF model are in BPR/Ranking/bpr_base.py
+_RANKING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _RANKING_DIR not in sys.path:
+    sys.path.insert(0, _RANKING_DIR)
+from bpr_base import BPRBase, EvaluationPolicy, IdIndex
+
+
+class BPR(BPRBase):
     """ 
     Bayesian Personalized Ranking using Factorization Machines 
     """
     
-    def __init__(self,df,test_size=0.1,num_components=5):
+    offer_column = 'offer_id'
+    parameter_names = ['strengths', 'feature_factors']
+    worker_attributes = ['n_users', 'offer_features']
+    default_checkpoints = 10
+    
+    def __init__(self,df,test_size=0.1,num_components=5,dtype=np.float64,keep_data=True):
         """
         Constructor
         
@@ -21,10 +35,20 @@ class BPR():
             df: pandas dataframe
             test_size: size (between 0 and 1) of the desired test split
             num_components: dimension of the latent vectors
+            dtype: floating point type of the parameters and of the values of the categories
+                   (np.float32 halves their memory)
+            keep_data: if False, the dataframes (df, positive/negative samples, train and test sets)
+                       and the dictionaries from request to offers are dropped once the arrays used by
+                       the training and the evaluation of the train and test sets are built, and the
+                       dictionaries from identifier to index are replaced by sorted arrays (IdIndex, as
+                       in load). The model then needs much less memory, but the metrics can only be
+                       computed on the full train and test sets
         """
         self.df = df 
         self.num_components = num_components 
         self.test_size = test_size
+        self.dtype = np.dtype(dtype)
+        self.keep_data = keep_data
         self.n_users = df['user_id'].nunique()
         self.categories = ['Quick', 'Reliable', 'Cheap', 'Comfortable', 'D2D', 'Env_Friendly', 'Short',
                            'Multitasking', 'Social', 'Panoramic', 'Healthy']
@@ -32,182 +56,197 @@ class BPR():
         
         
         
-        # one-hot-encoding for the users
-        self.ohe_user = pd.get_dummies(self.df.user_id.unique()).values
-        # dictionary from user id to index in the matrix of one-hot-encodings
-        self.userid_to_index = dict()
-        i = 0
-        for u in (self.df.user_id.unique()):
-            self.userid_to_index[u] = i
-            i += 1
+        # the user field is one-hot encoded, so it is represented by the index of the user (sorted by user id)
+        # instead of a dense n_users x n_users matrix. This index is also the row of the user in the
+        # parameters of the model
+        self.userid_to_index = dict(zip(np.sort(self.df.user_id.unique()), range(self.n_users)))
         
-        # separate positive and negative samples
-        positive_df = self.df[self.df['Response']==1].reset_index().drop('index', axis=1)
-        negative_df = self.df[self.df['Response']==0].reset_index().drop('index', axis=1)
-        # instances of the class
-        self.positive = positive_df
-        self.negative = negative_df
-        
-        
-        # creation of train and test sets (only positive samples)
-        reduced_test = pd.DataFrame()
-        reduced_train = self.positive.copy()
-        for u in self.positive['user_id'].unique():
-            user_df = self.positive[self.positive['user_id']==u]
-            test_samples = user_df.sample(n=ceil(self.test_size*len(user_df)), random_state=42, replace=False)
-            if len(user_df)>2:
-                reduced_test = reduced_test.append(test_samples)
-                reduced_train = reduced_train.drop(test_samples.index)
-        reduced_train = reduced_train.reset_index().drop('index', axis=1)
-        reduced_test = reduced_test.reset_index().drop('index', axis=1)
-        self.reduced_train = reduced_train
-        self.reduced_test = reduced_test
+        # train and test sets (positive samples) and dictionaries from request to offers
+        self.__split__()
+            
+        # matrix of values of the categories of each offer (all positive and negative items),
+        # computed once so that a prediction only reads one row
+        first_offers = self.df.drop_duplicates('offer_id')
+        self.offer_features = np.ascontiguousarray(first_offers[self.categories].values, dtype=self.dtype)
+        # dictionary from offer id to index in matrix of values 
+        self.offerid_2_index = dict(zip(first_offers['offer_id'].values, range(len(first_offers))))
         
-        # complete train (with positive and negative samples)
-        train = pd.DataFrame()
-        for requestid in self.reduced_train.request_id.unique():
-            requestdf = self.df[self.df['request_id']==requestid]
-            train = train.append(requestdf)
-        self.train = train
+        # same mappings as indexes (position = index in the parameters), for vectorized lookups
+        self.user_index = pd.Index(list(self.userid_to_index))
+        self.offer_index = pd.Index(list(self.offerid_2_index))
         
-        # complete the test (with positive and negative samples)
-        test = pd.DataFrame()
-        for requestid in self.reduced_test.request_id.unique():
-            requestdf = self.df[self.df['request_id']==requestid]
-            test = test.append(requestdf)
-        self.test = test 
+        # integer-encoded (user, positive offer, request) triples used by the SGD
+        self.__build_triple_store__()
         
-        # dictionary from request id to negative offers id
-        self.requestid_2_offerid_negative = dict()
-        for requestid in self.negative.request_id.unique():
-            request_df = self.negative[self.negative['request_id']==requestid]
-            self.requestid_2_offerid_negative[requestid] = list(request_df.offer_id.values)
-            
-        # dictionary from request id to positive offers id
-        self.requestid_2_offerid_positive = dict()
-        for requestid in self.positive.request_id.unique():
-            request_df = self.positive[self.positive['request_id']==requestid]
-            self.requestid_2_offerid_positive[requestid] = list(request_df.offer_id.values)
-            
-        # dictionary from offer id to index in matrix of values 
-        # all positive and negative items
-        reversed_dict = self.df['offer_id'].to_dict()
-        self.offerid_2_index = dict()
-        for index, offerid in reversed_dict.items():
-            self.offerid_2_index.setdefault(offerid, index)
+        # with keep_data=False, the dataframes are released once the train and test sets are encoded
+        self.__release_data__()
+
+    def __user_rows__(self, user_ids):
+        """
+        Indices of the given users in the parameters (-1 for new users)
+        """
+        return self.user_index.get_indexer(np.asarray(user_ids))
     
+    def __offer_rows__(self, offer_ids):
+        """
+        Indices of the given offers in offer_features (-1 for new offers)
+        """
+        return self.offer_index.get_indexer(np.asarray(offer_ids))
+
     def __sdg__(self):
         """ 
         Stochastic Gradient Descent
+        
+        Only the parameters of the non-zero features of the sampled pair are updated: the row of the
+        user and the rows of the categories. The regularization of the rows of the other users is
+        applied lazily, when the row is used again (or before computing the metrics). A worker of the
+        parallel training does not apply it to all the rows at the end, as the other workers are still
+        updating them: it leaves its pending steps of each user in pending_steps for __merge_workers__
         """
+        n_users = self.n_users
+        # factor applied to a parameter by the regularization at each step
+        decay = 1 + self.learning_rate*self.lmbda
+        # number of steps whose regularization is already applied to each user row
+        self.user_steps = np.zeros(n_users, dtype=np.int64)
+        # number of triples drawn at once
+        block_size = 10000
         i = 1
         j = 1
-        for _ in range(self.iterations):
-            # random sample (positive)
-            random_sample = self.reduced_train.sample()[['request_id','user_id','offer_id']]
-            rs_request_id = random_sample['request_id'].values[0]
-            positive_offer_id = random_sample['offer_id'].values[0]
-            user_id = random_sample['user_id'].values[0]
-            # find the index of the sample in the matrix of values
-            user_index = self.userid_to_index[user_id]
-            positive_offer_index = self.offerid_2_index[positive_offer_id]
-            x_i = np.concatenate([self.ohe_user[user_index],
-                                  self.df[self.categories].values[positive_offer_index]])
-            # prediction
-            f_i, first_sum_i = self.predict(user_id, positive_offer_id, sgd=True)
-            
-            # random sample (negative, from the same mobility request)
-            negative_offer_id = self.sample_offer_not_picked(rs_request_id)
-            # find the index of the sample in the matrix of values
-            negative_offer_index = self.offerid_2_index[negative_offer_id]
-            x_j = np.concatenate([self.ohe_user[user_index], 
-                                  self.df[self.categories].values[negative_offer_index]])
-            # prediction
-            f_j, first_sum_j = self.predict(user_id, negative_offer_id, sgd=True)
-            
-            # clip the exponential to avoid too large values
-            f_ij = f_i - f_j
-            if f_ij < -10:
-                f_ij = -10
-            
-            #operation shared (only computed once to not repeat the operation)
-            exponential = (np.exp(-f_ij))/(1+np.exp(-f_ij))
-
-            # update parameters
-            # strengths
-            self.strengths += self.learning_rate*(exponential*(x_i-x_j) + self.lmbda*self.strengths)
-            # features factors
-            for f in range(self.num_components):
-                first_derivative = x_i*first_sum_i[f] - self.feature_factors[:,f]*(x_i**2)
-                second_derivative = x_j*first_sum_j[f] - self.feature_factors[:,f]*(x_j**2)
-                self.feature_factors[:,f] += self.learning_rate*(exponential*(first_derivative-second_derivative) + 
-                                                                self.lmbda*self.feature_factors[:,f])
-            # compute and store metrics
-            if i%self.compute_metrics==0:
-                self.metrics_iterations.append(i)
-                print('{}/12'.format(j))
-                # accuracy test
-                print('Computing metrics...')
-                acu_test = self.compute_ACU(self.reduced_test)
-                self.acu_test.append(acu_test)
-                # accuracy train
-                acu_train = self.compute_ACU(self.reduced_train)
-                self.acu_train.append(acu_train)
-                # recall and MAP train
-                recall_at_k_train, MAP_train, pos_bias_train = self.metrics(self.train, [1,5,10])
-                self.recall_at_k_train.append(recall_at_k_train)
-                self.MAP_train.append(MAP_train)
-                self.pos_bias_train.append(pos_bias_train)
-                print('Metrics for train completed')
-                # recall and MAP test
-                recall_at_k_test, MAP_test, pos_bias_test = self.metrics(self.test, [1,5,10])
-                self.recall_at_k_test.append(recall_at_k_test)
-                self.MAP_test.append(MAP_test)
-                self.pos_bias_test.append(pos_bias_test)
-                print('Metrics for test completed')
-                j += 1
+        for block_start in range(0, self.iterations, block_size):
+            users, positive_offers, negative_offers = self.sample_triples(min(block_size, self.iterations-block_start))
+            for user_index, positive_offer_index, negative_offer_index in zip(users, positive_offers, negative_offers):
+                # regularization of the steps in which the user was not sampled
+                if self.user_steps[user_index] < i-1:
+                    scale = decay**(i-1-self.user_steps[user_index])
+                    self.strengths[user_index] *= scale
+                    self.feature_factors[user_index] *= scale
                 
-            i += 1
-            
+                # values of the categories of the positive and negative offers
+                x_i = self.offer_features[positive_offer_index]
+                x_j = self.offer_features[negative_offer_index]
+                user_factors = self.feature_factors[user_index]
+                categories_factors = self.feature_factors[n_users:]
+                categories_strengths = self.strengths[n_users:]
                 
-            
-        
-        
-    def fit(self, single_iterations=1e5, learning_rate = 0.1, lmbda = 0.01):
+                # predictions
+                first_sum_i = user_factors + np.dot(x_i, categories_factors)
+                first_sum_j = user_factors + np.dot(x_j, categories_factors)
+                f_i = np.dot(x_i, categories_strengths) + \
+                      0.5*np.sum(first_sum_i**2 - user_factors**2 - np.dot(x_i**2, categories_factors**2))
+                f_j = np.dot(x_j, categories_strengths) + \
+                      0.5*np.sum(first_sum_j**2 - user_factors**2 - np.dot(x_j**2, categories_factors**2))
+                
+                # clip the exponential to avoid too large values
+                f_ij = f_i - f_j
+                if f_ij < -10:
+                    f_ij = -10
+                
+                #operation shared (only computed once to not repeat the operation)
+                exponential = (np.exp(-f_ij))/(1+np.exp(-f_ij))
+                
+                # update parameters
+                # strengths (the user feature is the same in x_i and x_j)
+                self.strengths[user_index] *= decay
+                self.strengths[n_users:] += self.learning_rate*(exponential*(x_i-x_j) + self.lmbda*categories_strengths)
+                # features factors
+                first_derivative = np.outer(x_i, first_sum_i) - categories_factors*(x_i**2)[:,None]
+                second_derivative = np.outer(x_j, first_sum_j) - categories_factors*(x_j**2)[:,None]
+                self.feature_factors[n_users:] += self.learning_rate*(exponential*(first_derivative-second_derivative) +
+                                                                       self.lmbda*categories_factors)
+                self.feature_factors[user_index] += self.learning_rate*(exponential*(first_sum_i-first_sum_j) +
+                                                                        self.lmbda*user_factors)
+                self.user_steps[user_index] = i
+                
+                # compute and store metrics
+                if i%self.compute_metrics==0:
+                    self.__apply_regularization__(i)
+                    stop = self.__checkpoint__(i, j)
+                    j += 1
+                    if stop:
+                        return
+                
+                i += 1
+        if self.worker is None:
+            self.__apply_regularization__(self.iterations)
+        else:
+            self.pending_steps[self.worker] = self.iterations - self.user_steps
+
+    def __apply_regularization__(self, steps):
+        """
+        Apply the pending regularization to the rows of all users, up to the given number of steps
+        """
+        self.__regularize_users__(steps-self.user_steps)
+        self.user_steps[:] = steps
+
+    def __regularize_users__(self, steps):
+        """
+        Apply the regularization of the given number of steps (array with one value per user) to the rows of the users
+        """
+        scale = (1 + self.learning_rate*self.lmbda)**steps
+        self.strengths[:self.n_users] *= scale
+        self.feature_factors[:self.n_users] *= scale[:,None]
+
+    def __worker_arrays__(self):
+        """
+        Steps of each worker of the parallel training whose regularization is still pending, for each user
+        """
+        return {'pending_steps': np.zeros((self.n_jobs, self.n_users), dtype=np.int64)}
+
+    def __merge_workers__(self):
+        """
+        Apply the regularization left pending by the workers of the parallel training, once all of them
+        have finished
+        """
+        self.__regularize_users__(self.pending_steps.sum(axis=0))
+        self.pending_steps[:] = 0
+
+    def fit(self, single_iterations=1e5, learning_rate = 0.1, lmbda = 0.01, evaluation=None, n_jobs=1):
         """
         Starts the training process
         
         -Input:
             single_iterations: total number of iterations
             learning_rate: hyperparameter of the SGD
-            lmbda: regularizer of the SGD"""
+            lmbda: regularizer of the SGD
+            evaluation: EvaluationPolicy with the checkpoints and metrics to compute during the training
+                        (by default, all the metrics on the full train and test sets at 10 checkpoints)
+            n_jobs: number of worker processes. With n_jobs > 1 the workers update the parameters in
+                    shared memory without locks (Hogwild!), so the result is not deterministic. The rows
+                    of the 11 categories are written at every step by every worker, so their updates
+                    collide much more than the ones of the user rows. n_jobs=1 trains in this process
+                    (deterministic given the seed of np.random)"""
         
-        self.learning_rate = learning_rate 
-        self.lmbda = lmbda 
-        self.iterations = int(single_iterations)
-        self.compute_metrics = int(single_iterations/10)
         self.n_features = self.n_users + self.n_categories
             
         #initialize parameters
         self.bias = 0.0
-        self.strengths = np.ones(self.n_features)
+        self.strengths = np.ones(self.n_features, dtype=self.dtype)
         self.feature_factors = np.random.normal(scale = 1 / self.num_components, 
-                                                size = (self.n_features,self.num_components))
-        
-            
-        # lists to store the metrics (to follow the training process)
-        self.acu_test = list()
-        self.acu_train = list()
-        self.metrics_iterations = list()
-        self.recall_at_k_train = list()
-        self.recall_at_k_test = list()
-        self.MAP_train = list()
-        self.MAP_test = list()
-        self.pos_bias_train = list()
-        self.pos_bias_test = list()
-        
-        self.__sdg__()
+                                                size = (self.n_features,self.num_components)).astype(self.dtype)
+        self.__train__(single_iterations, learning_rate, lmbda, evaluation, n_jobs)
+
+    def __add_users_and_offers__(self, new_rows, positive):
+        """
+        Add the users and offers of new mobility requests (see partial_fit): the users not seen before
+        get a new row of parameters (initialized as in fit, and placed after the rows of the other
+        users), and the new offers are added to offer_features
+        """
+        # new users: their rows are inserted before the rows of the categories
+        new_users = [u for u in new_rows['user_id'].unique() if u not in self.userid_to_index]
+        self.__append_ids__(self.user_index_names, new_users)
+        self.__insert_rows__('strengths', self.n_users, np.ones(len(new_users)))
+        self.__insert_rows__('feature_factors', self.n_users, np.random.normal(scale = 1 / self.num_components,
+                                                                               size = (len(new_users),self.num_components)))
+        self.n_users += len(new_users)
+        self.n_features = self.n_users + self.n_categories
         
+        # new offers: values of their categories appended to offer_features
+        new_offers = new_rows.drop_duplicates('offer_id')
+        new_offers = new_offers[self.__offer_rows__(new_offers['offer_id']) < 0]
+        n_offers = len(self.offer_index)
+        self.__append_ids__(self.offer_index_names, new_offers['offer_id'].values)
+        self.__insert_rows__('offer_features', n_offers, new_offers[self.categories].values.astype(self.offer_features.dtype))
+
     def predict(self,user_id,offer_id,sgd=False):
         """
         Predict the score for a given user-offer pair using Factorization Machines
@@ -219,137 +258,131 @@ class BPR():
                  which is also used in the SGD. This way, I avoid recomputing it again
                  
         -Output:
-            pred: prediction score
+            pred: prediction score (see predict_batch for new users and new offers)
         """
+        
+        index_user = self.userid_to_index.get(user_id,-1)
+        index_offer = self.offerid_2_index.get(offer_id,-1)
+        pred, first_sum = self.__fm_scores__(np.array([index_user]), np.array([index_offer]))
+        if sgd == True:
+            return pred[0], first_sum[0]
+        else:
+            return pred[0]
 
-        index_user = self.userid_to_index.get(user_id,None)
-        if index_user is not None:
-            index_offer = self.offerid_2_index.get(offer_id,None)
-            if index_offer is not None:
-                # creating the feature vector 'x' 
-                x = np.concatenate([self.ohe_user[index_user],
-                                    self.df[self.categories].values[index_offer]])
-                # computing the prediction
-                first_sum = np.dot(x,self.feature_factors)
-                second_sum = np.dot(x**2, self.feature_factors**2)
-                pred = np.dot(x, self.strengths) + 0.5*np.sum(first_sum**2-second_sum)
-            if sgd == True:
-                return pred, first_sum
-            else:
-                return pred
-    
-    def sample_offer_not_picked(self,request_id):
+    def predict_batch(self, user_ids, offer_ids):
         """
-        Sample a negative offer from a given mobility requests
+        Predict the scores of many user-offer pairs at once (e.g. all the offers of a mobility request)
         
         -Input:
-            request_id: mobility request identifier
+            user_ids: list or array of user identifiers (or a single user identifier for all the offers)
+            offer_ids: list or array of offer identifiers
         
-        -Output: 
-            sampled_offer: negative offer from the mobility request
+        -Output:
+            pred: array with the prediction score of each pair. For a new user the score only uses the
+            categories of the offer (the user features are all zero), and the score of a new offer is 0.0
         """
+        offer_idx = self.offer_index.get_indexer(np.asarray(offer_ids))
+        if np.ndim(user_ids) == 0:
+            user_idx = np.full(len(offer_idx), self.userid_to_index.get(user_ids,-1))
+        else:
+            user_idx = self.user_index.get_indexer(np.asarray(user_ids))
+        pred, first_sum = self.__fm_scores__(user_idx, offer_idx)
+        return pred
 
-        offers = self.requestid_2_offerid_negative[request_id]
-        sampled_offer = np.random.choice(offers)
-        return sampled_offer
-    
-    
-    def compute_ACU(self,data):
-        sum_over_users = 0.0
-        for user_id in data.user_id.unique():
-            user_df = data[data['user_id']==user_id]
-            for request_id in user_df.request_id.unique():
-                request_df = user_df[user_df['request_id']==request_id]
-                offer_id = request_df['offer_id'].values[0]
-                f_i = self.predict(user_id,offer_id)
-                sum_over_offers = 0.0
-                for offer_negative in self.requestid_2_offerid_negative[request_id]:
-                    f_j = self.predict(user_id,offer_negative)
-                    sum_over_offers += self.Heaviside(f_i, f_j)
-                sum_over_users += sum_over_offers/(len(self.requestid_2_offerid_negative[request_id]))
-        return sum_over_users/(len(data.request_id.unique()))
-    
-    
-    def metrics(self,data,ks):
+    def __fm_scores__(self, user_idx, offer_idx):
         """
-        Compute Recall@k and MAP
+        Factorization Machines scores of (user, offer) pairs given by their indices, computed in matrix
+        form with the O(kn) reformulation of the pairwise interactions
         
-        -Input:
-            data: pandas dataframe containing the data to evaluate (e.i. train set or test set)
-            ks: list containing the different 'k' to evaluate
-            
         -Output:
-            recall_at_k_average: recall@k for each user (averaged over all the mobility requests
-            of each user)
-            MAP: Mean Average Precision for each user (averaged over all the mobility requests
-            of each user)
+            pred: array of prediction scores (user features set to zero if the user index is -1,
+                  0.0 if the offer index is -1)
+            first_sum: array with the sum of the factors of the features of each pair
         """
+        known_user = user_idx >= 0
+        known_offer = offer_idx >= 0
+        x = self.offer_features[np.maximum(offer_idx, 0)]
+        user_factors = self.feature_factors[np.maximum(user_idx, 0)]*known_user[:,None]
+        user_strengths = self.strengths[np.maximum(user_idx, 0)]*known_user
+        categories_factors = self.feature_factors[self.n_users:]
+        first_sum = user_factors + np.dot(x, categories_factors)
+        second_sum = user_factors**2 + np.dot(x**2, categories_factors**2)
+        pred = user_strengths + np.dot(x, self.strengths[self.n_users:]) + 0.5*np.sum(first_sum**2-second_sum, axis=1)
+        pred[~known_offer] = 0.0
+        first_sum[~known_offer] = 0.0
+        return pred, first_sum
+
+    def __score_pairs__(self, user_idx, offer_idx):
+        """
+        Prediction scores of (user, offer) pairs given by their indices (see __fm_scores__)
+        """
+        pred, first_sum = self.__fm_scores__(user_idx, offer_idx)
+        return pred
+
+    def save(self, path):
+        """
+        Save the trained model in a directory, one .npy file per array, so that it can be opened
+        (and memory-mapped) by a serving process without the training data
         
-        # creation of dictionaries to store the data
-        votings = dict()
-        recall_at_k = dict()
-        recall_at_k_average = dict()
-        ap = dict()
-        pos_bias = dict()
-        MAP = dict()
-        pos_bias_avg = dict()
-        for k in ks:
-            recall_at_k.setdefault(k,{})
-            recall_at_k_average.setdefault(k,{})
-            for userid in data.user_id.unique():
-                recall_at_k[k].setdefault(userid, 0)
-                recall_at_k_average[k].setdefault(userid, 0)
-        for userid in data.user_id.unique():
-            votings.setdefault(userid,{})
-            ap.setdefault(userid, 0.0)
-            pos_bias.setdefault(userid, 0.0)
-            pos_bias_avg.setdefault(userid, 0.0)
-            MAP.setdefault(userid,0)
-            user_df = data[data['user_id']==userid]
-            for requestid in user_df.request_id.unique():
-                votings[userid].setdefault(requestid, {})
-                request_df = user_df[user_df['request_id']==requestid]
-                offers = request_df.offer_id.unique()
-                for i in range(len(offers)-1):
-                    offer_i = offers[i]
-                    f_i = self.predict(userid, offer_i)
-                    votings[userid][requestid].setdefault(offer_i, 0.0)
-                    for j in range(i+1,len(offers)):
-                        offer_j = offers[j]
-                        votings[userid][requestid].setdefault(offer_j, 0.0)
-                        f_j = self.predict(userid, offer_j)
-                        f_ij = f_i - f_j
-                        if f_ij < -10:
-                            f_ij = -10
-                        probability = 1./(1.+np.exp(-f_ij))
-                        if probability > 0.5:
-                            votings[userid][requestid][offer_i] += 1
-                        else:
-                            votings[userid][requestid][offer_j] += 1
-                positive_offer = self.requestid_2_offerid_positive[requestid][0]
-                ranking = sorted(votings[userid][requestid],key=votings[userid][requestid].get,reverse=True)
-                for k in ks:
-                    if positive_offer in ranking[0:k]:
-                        recall_at_k[k][userid] += 1
-                        if k == 5:
-                            ap[userid] += 1.0/float((ranking[0:k].index(positive_offer)+1))
-                            pos_bias[userid] += 1.0/(np.log(1+float((ranking[0:k].index(positive_offer)+1))))
-            for k in ks:
-                recall_at_k_average[k][userid] = recall_at_k[k][userid]/user_df.request_id.nunique()
-                if k==5:
-                    MAP[userid] = ap[userid]/user_df.request_id.nunique()
-                    pos_bias_avg[userid] = pos_bias[userid]/user_df.request_id.nunique()
-        return recall_at_k_average, MAP, pos_bias_avg
+        -Input:
+            path: directory where the model is stored (created if it does not exist)
+        
+        Files:
+            strengths.npy, feature_factors.npy: parameters of the model (users first, then categories)
+            offer_features.npy: values of the categories of each offer
+            user_ids.npy, offer_ids.npy: sorted identifiers
+            user_rows.npy, offer_rows.npy: index of each identifier of user_ids.npy and offer_ids.npy
+            model.json: dimension of the latent vectors and names of the categories
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'strengths.npy'), self.strengths)
+        np.save(os.path.join(path, 'feature_factors.npy'), self.feature_factors)
+        np.save(os.path.join(path, 'offer_features.npy'), self.offer_features)
+        IdIndex.from_ids(self.user_index.tolist()).save(path, 'user')
+        IdIndex.from_ids(self.offer_index.tolist()).save(path, 'offer')
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            json.dump({'model': 'BPR_FM', 'num_components': self.num_components,
+                       'categories': self.categories}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model saved with save(). The loaded model can predict scores (predict, predict_batch),
+        but it does not contain the training data. The identifiers are looked up by binary search in
+        their sorted arrays (see IdIndex), so no dictionary is built when the model is opened
+        
+        -Input:
+            path: directory where the model is stored
+            mmap: if True, the arrays are memory-mapped (read-only) instead of read into memory
+        
+        -Output:
+            model: BPR instance
+        """
+        with open(os.path.join(path, 'model.json')) as f:
+            config = json.load(f)
+        model = cls.__new__(cls)
+        model.num_components = config['num_components']
+        model.categories = config['categories']
+        model.n_categories = len(model.categories)
+        model.keep_data = False
+        mmap_mode = 'r' if mmap else None
+        model.strengths = np.load(os.path.join(path, 'strengths.npy'), mmap_mode=mmap_mode)
+        model.feature_factors = np.load(os.path.join(path, 'feature_factors.npy'), mmap_mode=mmap_mode)
+        model.offer_features = np.load(os.path.join(path, 'offer_features.npy'), mmap_mode=mmap_mode)
+        model.user_index = IdIndex.load(path, 'user', mmap_mode)
+        model.offer_index = IdIndex.load(path, 'offer', mmap_mode)
+        # the same indexes are used as dictionaries from identifier to index
+        model.userid_to_index = model.user_index
+        model.offerid_2_index = model.offer_index
+        model.n_users = len(model.user_index)
+        model.n_features = model.n_users + model.n_categories
+        model.dtype = model.feature_factors.dtype
+        model.parameter_buffers = dict()
+        return model
 
-    
-    
     def Heaviside(self,x1,x2):
         
         if x1 > x2:
             return 1.0
         else:
             return 0.0
-
-        
-            
-
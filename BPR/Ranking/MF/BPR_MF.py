@@ -4,16 +4,33 @@
 # In[ ]:
 
 
+import json
+import os
+import sys
 import numpy as np
 import pandas as pd
-from math import ceil
 
-class BPR():
+# the parts of the training shared with the FM model are in BPR/Ranking/bpr_base.py
+_RANKING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _RANKING_DIR not in sys.path:
+    sys.path.insert(0, _RANKING_DIR)
+from bpr_base import BPRBase, EvaluationPolicy, IdIndex
+
+
+class BPR(BPRBase):
     """ 
     Bayesian Personalized Ranking using Matrix Factorization 
     """
     
-    def __init__(self,df,test_size=0.1,num_components=5):
+    # the offers scored by the model are identified by the column 'id'
+    offer_column = 'id'
+    parameter_names = ['user_vecs', 'item_vecs']
+    user_index_names = ('userid_to_idx', 'user_index')
+    offer_index_names = ('itemid_to_idx', 'item_index')
+    worker_attributes = ['batch_size']
+    default_checkpoints = 12
+    
+    def __init__(self,df,test_size=0.1,num_components=5,dtype=np.float64,keep_data=True):
         """
         Constructor
         
@@ -21,169 +38,173 @@ class BPR():
             df: pandas dataframe
             test_size: size (between 0 and 1) of the desired test split
             num_components: dimension of the latent vectors
+            dtype: floating point type of the latent vectors (np.float32 halves their memory)
+            keep_data: if False, the dataframes (df, positive/negative samples, train and test sets)
+                       and the dictionaries from request to offers are dropped once the integer arrays
+                       used by the training and the evaluation of the train and test sets are built,
+                       and the dictionaries from identifier to matrix index are replaced by sorted arrays
+                       (IdIndex, as in load). The model then needs much less memory, but the metrics can
+                       only be computed on the full train and test sets
         """
         self.df = df 
         self.num_components = num_components 
         self.test_size = test_size
+        self.dtype = np.dtype(dtype)
+        self.keep_data = keep_data
         
-        # separate positive and negative samples
-        positive_df = self.df[self.df['Response']==1].reset_index().drop('index', axis=1)
-        negative_df = self.df[self.df['Response']==0].reset_index().drop('index', axis=1)
-        # instances of the class
-        self.positive = positive_df
-        self.negative = negative_df
-        
-        
-        # creation of train and test sets (only positive samples)
-        reduced_test = pd.DataFrame()
-        reduced_train = self.positive.copy()
-        for u in self.positive['user_id'].unique():
-            user_df = self.positive[self.positive['user_id']==u]
-            test_samples = user_df.sample(n=ceil(self.test_size*len(user_df)), random_state=42, replace=False)
-            if len(user_df)>2:
-                reduced_test = reduced_test.append(test_samples)
-                reduced_train = reduced_train.drop(test_samples.index)
-        reduced_train = reduced_train.reset_index().drop('index', axis=1)
-        reduced_test = reduced_test.reset_index().drop('index', axis=1)
-        self.reduced_train = reduced_train
-        self.reduced_test = reduced_test
+        # train and test sets (positive samples) and dictionaries from request to offers
+        self.__split__()
         
         self.n_users = self.reduced_train.user_id.nunique()
         self.n_items = self.reduced_train.id.nunique()
         
-        # complete train (with positive and negative samples)
-        train = pd.DataFrame()
-        for requestid in self.reduced_train.request_id.unique():
-            requestdf = self.df[self.df['request_id']==requestid]
-            train = train.append(requestdf)
-        self.train = train
-        
-        # complete the test (with positive and negative samples)
-        test = pd.DataFrame()
-        for requestid in self.reduced_test.request_id.unique():
-            requestdf = self.df[self.df['request_id']==requestid]
-            test = test.append(requestdf)
-        self.test = test
-        
-        
-        # dictionary from request id to negative offers id
-        self.requestid_2_offerid_negative = dict()
-        for requestid in self.negative.request_id.unique():
-            request_df = self.negative[self.negative['request_id']==requestid]
-            self.requestid_2_offerid_negative[requestid] = list(request_df.id.values)
-            
-        # dictionary from request id to positive offers id
-        self.requestid_2_offerid_positive = dict()
-        for requestid in self.positive.request_id.unique():
-            request_df = self.positive[self.positive['request_id']==requestid]
-            self.requestid_2_offerid_positive[requestid] = list(request_df.id.values)
-            
         # creation of dictionaries to convert from id to matrix indices
         self.userid_to_idx = dict(zip(np.sort(self.reduced_train['user_id'].unique()),
                                       range(self.reduced_train['user_id'].nunique())))
         
         self.itemid_to_idx = dict(zip(np.sort(self.reduced_train['id'].unique()),
                                       range(self.reduced_train['id'].nunique())))
-            
+
+        # same mappings as indexes (position = matrix index), for vectorized lookups
+        self.user_index = pd.Index(list(self.userid_to_idx))
+        self.item_index = pd.Index(list(self.itemid_to_idx))
+
+        # integer-encoded (user, positive offer, request) triples used by the SGD
+        self.__build_triple_store__()
+
+        # with keep_data=False, the dataframes are released once the train and test sets are encoded
+        self.__release_data__()
+
+    def __user_rows__(self, user_ids):
+        """
+        Matrix indices of the given users (-1 for users without latent vector)
+        """
+        return self.user_index.get_indexer(np.asarray(user_ids))
     
+    def __offer_rows__(self, item_ids):
+        """
+        Matrix indices of the given offers (column 'id', -1 for offers without latent vector)
+        """
+        return self.item_index.get_indexer(np.asarray(item_ids))
+
     def __sdg__(self):
-        """ 
+        """
         Stochastic Gradient Descent
         """
+        if self.batch_size > 1:
+            self.__sdg_batch__()
+            return
+        # number of triples drawn at once
+        block_size = 10000
         i = 1
         j = 1
-        for _ in range(self.iterations):
-            # random sample (positive)
-            random_sample = self.reduced_train.sample()[['request_id','user_id','id']]
-            rs_request_id = random_sample['request_id'].values[0]
-            positive_offer_id = random_sample['id'].values[0]
-            user_id = random_sample['user_id'].values[0]
-            # indeces
-            user_index = self.userid_to_idx[user_id]
-            positive_offer_index = self.itemid_to_idx[positive_offer_id]
-
-            # prediction
-            f_i = self.predict(user_id, positive_offer_id)
-            
-            # random sample (negative, from the same set of offers)
-            negative_offer_id = self.sample_offer_not_picked(rs_request_id)
-            # indeces
-            negative_offer_index = self.itemid_to_idx[negative_offer_id]
-            # prediction
-            f_j = self.predict(user_id, negative_offer_id)
-            
-            f_ij = f_i - f_j
-            if f_ij < -10:
-                f_ij = -10
-            
+        for block_start in range(0, self.iterations, block_size):
+            users, positive_items, negative_items = self.sample_triples(min(block_size, self.iterations-block_start))
+            for user_index, positive_offer_index, negative_offer_index in zip(users, positive_items, negative_items):
+                # predictions
+                f_i = np.dot(self.user_vecs[user_index], self.item_vecs[positive_offer_index])
+                f_j = np.dot(self.user_vecs[user_index], self.item_vecs[negative_offer_index])
+
+                f_ij = f_i - f_j
+                if f_ij < -10:
+                    f_ij = -10
+
+                #operation shared (only computed once to not repeat the operation)
+                exponential = (np.exp(-f_ij))/(1+np.exp(-f_ij))
+
+                # update parameters
+                self.user_vecs[user_index,:] += self.learning_rate*(exponential*(self.item_vecs[positive_offer_index,:] - self.item_vecs[negative_offer_index,:]) + self.lmbda*self.user_vecs[user_index,:])
+
+                self.item_vecs[positive_offer_index,:] += self.learning_rate*(exponential* self.user_vecs[user_index,:] + self.lmbda*self.item_vecs[positive_offer_index,:])
+
+                self.item_vecs[negative_offer_index,:] += self.learning_rate*(-exponential* self.user_vecs[user_index,:] + self.lmbda*self.item_vecs[negative_offer_index,:])
+                if i%self.compute_metrics==0:
+                    stop = self.__checkpoint__(i, j)
+                    j += 1
+                    if stop:
+                        return
+                i += 1
+
+    def __sdg_batch__(self):
+        """
+        Mini-batch Stochastic Gradient Descent
+
+        The gradients of batch_size triples are computed at once from the current parameters and
+        accumulated with np.add.at, so users or offers repeated in a batch receive the sum of their
+        single-sample updates. A batch never crosses a checkpoint, so the metrics are computed at
+        the same iterations as with batch_size=1
+        """
+        i = 0
+        j = 1
+        while i < self.iterations:
+            size = min(self.batch_size, self.iterations-i, self.compute_metrics - i%self.compute_metrics)
+            users, positive_items, negative_items = self.sample_triples(size)
+            user_vecs = self.user_vecs[users]
+            positive_vecs = self.item_vecs[positive_items]
+            negative_vecs = self.item_vecs[negative_items]
+
+            # predictions
+            f_ij = np.sum(user_vecs*(positive_vecs-negative_vecs), axis=1)
+            f_ij = np.maximum(f_ij, -10)
+
             #operation shared (only computed once to not repeat the operation)
-            exponential = (np.exp(-f_ij))/(1+np.exp(-f_ij))
+            exponential = ((np.exp(-f_ij))/(1+np.exp(-f_ij)))[:,None]
 
             # update parameters
-            self.user_vecs[user_index,:] += self.learning_rate*(exponential*(self.item_vecs[positive_offer_index,:] - self.item_vecs[negative_offer_index,:]) + self.lmbda*self.user_vecs[user_index,:])
-            
-            self.item_vecs[positive_offer_index,:] += self.learning_rate*(exponential* self.user_vecs[user_index,:] + self.lmbda*self.item_vecs[positive_offer_index,:])
-            
-            self.item_vecs[negative_offer_index,:] += self.learning_rate*(-exponential* self.user_vecs[user_index,:] + self.lmbda*self.item_vecs[negative_offer_index,:])
-            if i%self.compute_metrics==0:
-                self.metrics_iterations.append(i)
-                print('{}/12'.format(j))
-                # accuracy test
-                print('Computing metrics...')
-                acu_test = self.compute_ACU(self.reduced_test)
-                self.acu_test.append(acu_test)
-                # accuracy train
-                acu_train = self.compute_ACU(self.reduced_train)
-                self.acu_train.append(acu_train)
-                # recall and MAP train
-                recall_at_k_train, MAP_train, pos_bias_train = self.metrics(self.train, [1,5,10])
-                self.recall_at_k_train.append(recall_at_k_train)
-                self.MAP_train.append(MAP_train)
-                self.pos_bias_train.append(pos_bias_train)
-                print('Metrics for train completed')
-                # recall and MAP test
-                recall_at_k_test, MAP_test, pos_bias_test = self.metrics(self.test, [1,5,10])
-                self.recall_at_k_test.append(recall_at_k_test)
-                self.MAP_test.append(MAP_test)
-                self.pos_bias_test.append(pos_bias_test)
-                print('Metrics for test completed')
+            np.add.at(self.user_vecs, users, self.learning_rate*(exponential*(positive_vecs-negative_vecs) + self.lmbda*user_vecs))
+            np.add.at(self.item_vecs, positive_items, self.learning_rate*(exponential*user_vecs + self.lmbda*positive_vecs))
+            np.add.at(self.item_vecs, negative_items, self.learning_rate*(-exponential*user_vecs + self.lmbda*negative_vecs))
+
+            # checkpoint at the end of the batch if it reaches a multiple of compute_metrics
+            if (i+size)%self.compute_metrics==0:
+                stop = self.__checkpoint__(i+size, j)
                 j += 1
-            i += 1
-            
-                
-    def fit(self, single_iterations=1e5, learning_rate = 0.1, lmbda = 0.01):
+                if stop:
+                    return
+            i += size
+
+    def fit(self, single_iterations=1e5, learning_rate = 0.1, lmbda = 0.01, batch_size=1, evaluation=None, n_jobs=1):
         """
         Starts the training process
         
         -Input:
-            single_iterations: total number of iterations
+            single_iterations: total number of iterations (number of sampled triples)
             learning_rate: hyperparameter of the SGD
-            lmbda: regularizer of the SGD"""
+            lmbda: regularizer of the SGD
+            batch_size: number of triples per update. With batch_size=1 the parameters are updated after
+                        every sample; with larger values the gradients of the whole mini-batch are computed
+                        with array operations and applied at once
+            evaluation: EvaluationPolicy with the checkpoints and metrics to compute during the training
+                        (by default, all the metrics on the full train and test sets at 12 checkpoints)
+            n_jobs: number of worker processes. With n_jobs > 1 the workers update the parameters in
+                    shared memory without locks (Hogwild!), so the result is not deterministic.
+                    n_jobs=1 trains in this process (deterministic given the seed of np.random)"""
+        
+        self.batch_size = int(batch_size)
         
-        self.learning_rate = learning_rate 
-        self.lmbda = lmbda 
-        self.iterations = int(single_iterations)
-        self.compute_metrics = int(single_iterations/12)
-            
         # initialize latent vectors
-        self.user_vecs = np.random.normal(scale=1./self.num_components,                                          size=(self.n_users, self.num_components))
+        self.user_vecs = np.random.normal(scale=1./self.num_components,                                          size=(self.n_users, self.num_components)).astype(self.dtype)
         self.item_vecs = np.random.normal(scale=1./self.num_components,
-                                          size=(self.n_items, self.num_components))
-        
-            
-        #to follow the training process
-        self.acu_test = list()
-        self.acu_train = list()
-        self.metrics_iterations = list()
-        self.recall_at_k_train = list()
-        self.recall_at_k_test = list()
-        self.MAP_train = list()
-        self.MAP_test = list()
-        self.pos_bias_train = list()
-        self.pos_bias_test = list()
-        
-        self.__sdg__()
-        
+                                          size=(self.n_items, self.num_components)).astype(self.dtype)
+        self.__train__(single_iterations, learning_rate, lmbda, evaluation, n_jobs)
+
+    def __add_users_and_offers__(self, new_rows, positive):
+        """
+        Add the users and chosen offers of new mobility requests (see partial_fit): the ones not seen
+        before get a new latent vector (initialized as in fit), appended to the matrix indices
+        """
+        # new users and offers are appended to the matrix indices
+        new_users = [u for u in positive['user_id'].unique() if u not in self.userid_to_idx]
+        new_items = [i for i in positive['id'].unique() if i not in self.itemid_to_idx]
+        self.__append_ids__(self.user_index_names, new_users)
+        self.__append_ids__(self.offer_index_names, new_items)
+        self.__insert_rows__('user_vecs', self.n_users, np.random.normal(scale=1./self.num_components,
+                                                                         size=(len(new_users), self.num_components)))
+        self.__insert_rows__('item_vecs', self.n_items, np.random.normal(scale=1./self.num_components,
+                                                                         size=(len(new_items), self.num_components)))
+        self.n_users += len(new_users)
+        self.n_items += len(new_items)
+
     def predict(self,user_id,item_id): 
         """
         Predict the score for a given user-offer pair using Factorization Machines
@@ -204,128 +225,137 @@ class BPR():
                 return 0.0 # new item
         else:
             return 0.0 #new user -> p(i>j) = 0.5
-    
-    def sample_offer_not_picked(self,request_id):
+
+    def score_request(self, user_id, offer_ids):
         """
-        Sample a negative offer from a given mobility requests
+        Predict the scores of several offers (e.g. all the offers of a mobility request) for a given user
         
         -Input:
-            request_id: mobility request identifier
+            user_id: user identifier
+            offer_ids: list or array of offer identifiers
         
-        -Output: 
-            sampled_offer: negative offer from the mobility request
+        -Output:
+            scores: array with the prediction score of each offer (0.0 for new users or new offers)
         """
-        
-        offers = self.requestid_2_offerid_negative[request_id]
-        condition = False
-        k = 0
-        while condition == False and k<50:
-            sampled_offer = np.random.choice(offers)
-            if sampled_offer in self.reduced_train.id.unique():
-                condition = True
-                return sampled_offer
-            k += 1
-        return 25
-    
-    
-    def compute_ACU(self,data):
-        sum_over_users = 0.0
-        for user_id in data.user_id.unique():
-            user_df = data[data['user_id']==user_id]
-            for request_id in user_df.request_id.unique():
-                request_df = user_df[user_df['request_id']==request_id]
-                offer_id = request_df['id'].values[0]
-                f_i = self.predict(user_id,offer_id)
-                sum_over_offers = 0.0
-                for offer_negative in self.requestid_2_offerid_negative[request_id]:
-                    f_j = self.predict(user_id,offer_negative)
-                    sum_over_offers += self.Heaviside(f_i, f_j)
-                sum_over_users += sum_over_offers/(len(self.requestid_2_offerid_negative[request_id]))
-        return sum_over_users/(len(data.request_id.unique()))
-
-
- 
-    
-    
-    def metrics(self,data,ks):
+        offer_idx = self.item_index.get_indexer(np.asarray(offer_ids))
+        scores = np.zeros(len(offer_idx))
+        user_idx = self.userid_to_idx.get(user_id,None)
+        if user_idx is not None:
+            known = offer_idx >= 0
+            scores[known] = self.user_vecs[user_idx] @ self.item_vecs[offer_idx[known]].T
+        return scores
+
+    def score_matrix(self, user_ids, offer_ids):
         """
-        Compute Recall@k and MAP
+        Predict the scores of several offers for several users
+        
+        -Input:
+            user_ids: list or array of user identifiers
+            offer_ids: list or array of offer identifiers
         
+        -Output:
+            scores: matrix of shape (len(user_ids), len(offer_ids)) with the prediction scores
+            (0.0 for new users or new offers)
+        """
+        user_idx = self.user_index.get_indexer(np.asarray(user_ids))
+        offer_idx = self.item_index.get_indexer(np.asarray(offer_ids))
+        scores = self.user_vecs[np.maximum(user_idx, 0)] @ self.item_vecs[np.maximum(offer_idx, 0)].T
+        scores[user_idx < 0, :] = 0.0
+        scores[:, offer_idx < 0] = 0.0
+        return scores
+
+    def recommend(self, user_id, k=10, index=None):
+        """
+        Best k offers of the model for a given user, without calling predict for every offer
+
         -Input:
-            data: pandas dataframe containing the data to evaluate (e.i. train set or test set)
-            ks: list containing the different 'k' to evaluate
-            
+            user_id: user identifier
+            k: number of offers to retrieve
+            index: top-k retrieval index over item_vecs (retrieval.ExactIndex or retrieval.IVFIndex),
+                   built once and reused for all the users. If None, all the offers are scored
+
         -Output:
-            recall_at_k_average: recall@k for each user (averaged over all the mobility requests
-            of each user)
-            MAP: Mean Average Precision for each user (averaged over all the mobility requests
-            of each user)
+            offer_ids: array with the identifiers of the best k offers, sorted by decreasing score
+            (empty for a new user, since all the offers have the same score)
         """
+        user_idx = self.userid_to_idx.get(user_id,None)
+        if user_idx is None:
+            return np.asarray(self.item_index[:0])
+        if index is not None:
+            offer_ids, scores = index.search(self.user_vecs[user_idx], k)
+            return offer_ids[0]
+        scores = self.item_vecs @ self.user_vecs[user_idx]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k-1)[:k] if k > 0 else np.arange(0)
+        return np.asarray(self.item_index[top[np.argsort(-scores[top], kind='stable')]])
+
+    def save(self, path):
+        """
+        Save the trained model in a directory, one .npy file per array, so that it can be opened
+        (and memory-mapped) by a serving process without the training data
         
-        votings = dict()
-        recall_at_k = dict()
-        recall_at_k_average = dict()
-        ap = dict()
-        MAP = dict()
-        pos_bias = dict()
-        pos_bias_avg = dict()
-        for k in ks:
-            recall_at_k.setdefault(k,{})
-            recall_at_k_average.setdefault(k,{})
-            for userid in data.user_id.unique():
-                recall_at_k[k].setdefault(userid, 0)
-                recall_at_k_average[k].setdefault(userid, 0)
-        for userid in data.user_id.unique():
-            votings.setdefault(userid,{})
-            ap.setdefault(userid, 0.0)
-            pos_bias.setdefault(userid, 0.0)
-            pos_bias_avg.setdefault(userid, 0.0)
-            MAP.setdefault(userid,0)
-            user_df = data[data['user_id']==userid]
-            for requestid in user_df.request_id.unique():
-                votings[userid].setdefault(requestid, {})
-                request_df = user_df[user_df['request_id']==requestid]
-                offers = request_df.id.unique()
-                for i in range(len(offers)-1):
-                    offer_i = offers[i]
-                    f_i = self.predict(userid, offer_i)
-                    votings[userid][requestid].setdefault(offer_i, 0.0)
-                    for j in range(i+1,len(offers)):
-                        offer_j = offers[j]
-                        votings[userid][requestid].setdefault(offer_j, 0.0)
-                        f_j = self.predict(userid, offer_j)
-                        f_ij = f_i - f_j
-                        if f_ij < -10:
-                            f_ij = -10
-                        probability = 1./(1.+np.exp(-f_ij))
-                        if probability > 0.5:
-                            votings[userid][requestid][offer_i] += 1
-                        else:
-                            votings[userid][requestid][offer_j] += 1
-                positive_offer = self.requestid_2_offerid_positive[requestid][0]
-                ranking = sorted(votings[userid][requestid],key=votings[userid][requestid].get,reverse=True)
-                for k in ks:
-                    if positive_offer in ranking[0:k]:
-                        recall_at_k[k][userid] += 1
-                        if k == 5:
-                            ap[userid] += 1.0/float((ranking[0:k].index(positive_offer)+1))
-                            pos_bias[userid] += 1.0/(np.log(1+float((ranking[0:k].index(positive_offer)+1))))
-            for k in ks:
-                recall_at_k_average[k][userid] = recall_at_k[k][userid]/user_df.request_id.nunique()
-                if k==5:
-                    MAP[userid] = ap[userid]/user_df.request_id.nunique()
-                    pos_bias_avg[userid] = pos_bias[userid]/user_df.request_id.nunique()
-        return recall_at_k_average, MAP, pos_bias_avg
+        -Input:
+            path: directory where the model is stored (created if it does not exist)
+        
+        Files:
+            user_vecs.npy, item_vecs.npy: latent vectors
+            user_ids.npy, item_ids.npy: sorted identifiers
+            user_rows.npy, item_rows.npy: matrix index of each identifier of user_ids.npy and item_ids.npy
+            model.json: dimension of the latent vectors
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'user_vecs.npy'), self.user_vecs)
+        np.save(os.path.join(path, 'item_vecs.npy'), self.item_vecs)
+        IdIndex.from_ids(self.user_index.tolist()).save(path, 'user')
+        IdIndex.from_ids(self.item_index.tolist()).save(path, 'item')
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            json.dump({'model': 'BPR_MF', 'num_components': self.num_components}, f)
 
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model saved with save(). The loaded model can predict and score offers
+        (predict, score_request, score_matrix), but it does not contain the training data.
+        The identifiers are looked up by binary search in their sorted arrays (see IdIndex),
+        so no dictionary is built when the model is opened
+        
+        -Input:
+            path: directory where the model is stored
+            mmap: if True, the latent vectors and the identifiers are memory-mapped (read-only) instead
+                  of read into memory
+        
+        -Output:
+            model: BPR instance
+        """
+        with open(os.path.join(path, 'model.json')) as f:
+            config = json.load(f)
+        model = cls.__new__(cls)
+        model.num_components = config['num_components']
+        model.keep_data = False
+        mmap_mode = 'r' if mmap else None
+        model.user_vecs = np.load(os.path.join(path, 'user_vecs.npy'), mmap_mode=mmap_mode)
+        model.item_vecs = np.load(os.path.join(path, 'item_vecs.npy'), mmap_mode=mmap_mode)
+        model.user_index = IdIndex.load(path, 'user', mmap_mode)
+        model.item_index = IdIndex.load(path, 'item', mmap_mode)
+        # the same indexes are used as dictionaries from identifier to matrix index
+        model.userid_to_idx = model.user_index
+        model.itemid_to_idx = model.item_index
+        model.n_users = len(model.user_index)
+        model.n_items = len(model.item_index)
+        model.dtype = model.user_vecs.dtype
+        model.parameter_buffers = dict()
+        return model
+
+    def __score_pairs__(self, user_idx, item_idx):
+        """
+        Prediction scores of (user, offer) pairs given by their matrix indices (0.0 when an index is -1)
+        """
+        scores = np.einsum('ij,ij->i', self.user_vecs[np.maximum(user_idx, 0)], self.item_vecs[np.maximum(item_idx, 0)])
+        scores[(user_idx < 0) | (item_idx < 0)] = 0.0
+        return scores
 
-    
-    
     def Heaviside(self,x1,x2):
         if x1 > x2:
             return 1.0
         else:
             return 0.0
-
-        
-            
-
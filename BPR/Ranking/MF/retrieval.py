@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+##############################################################################
+# Top-k retrieval of offers over the latent vectors of a trained BPR_MF model.
+# The score of an offer for a user is the inner product of their latent vectors,
+# so retrieving the best offers is a maximum inner product search
+
+import numpy as np
+
+
+def top_k(scores, k):
+    """
+    Columns of the k largest scores of each row, sorted by decreasing score
+
+    -Input:
+        scores: matrix of shape (n_queries, n_candidates)
+        k: number of columns to keep (at most n_candidates)
+
+    -Output:
+        columns: matrix of shape (n_queries, k) with the selected columns
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    columns = np.argpartition(-scores, k-1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, columns, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(columns, order, axis=1)
+
+
+class ExactIndex():
+    """
+    Exact top-k retrieval: the scores of all the offers are computed with a blocked matrix
+    multiplication, keeping only the best k offers of each block (argpartition)
+    """
+
+    def __init__(self, item_vecs, item_ids, block_size=50000):
+        """
+        Constructor
+
+        - Arguments:
+            item_vecs: matrix with the latent vector of each offer (e.g. BPR.item_vecs)
+            item_ids: identifier of each row of item_vecs (e.g. BPR.item_index)
+            block_size: number of offers scored at once, which bounds the memory used by a search
+                        to n_queries x block_size scores
+        """
+        self.item_vecs = item_vecs
+        self.item_ids = np.asarray(item_ids)
+        self.block_size = block_size
+
+    @classmethod
+    def from_model(cls, model, **kwargs):
+        """
+        Index of the offers of a trained (or loaded) BPR_MF model
+        """
+        return cls(model.item_vecs, model.item_index, **kwargs)
+
+    def search(self, query_vecs, k=10):
+        """
+        Best k offers for each query vector
+
+        -Input:
+            query_vecs: matrix of shape (n_queries, num_components) (e.g. the latent vectors of some users)
+            k: number of offers to retrieve
+
+        -Output:
+            ids: matrix of shape (n_queries, k) with the offer identifiers, sorted by decreasing score
+            scores: matrix of shape (n_queries, k) with their scores
+        """
+        query_vecs = np.atleast_2d(query_vecs)
+        best_rows = np.empty((len(query_vecs), 0), dtype=np.int64)
+        best_scores = np.empty((len(query_vecs), 0))
+        for start in range(0, len(self.item_vecs), self.block_size):
+            block_scores = query_vecs @ self.item_vecs[start:start+self.block_size].T
+            block_rows = top_k(block_scores, k)
+            # merge the best offers of the block with the best offers so far
+            candidate_rows = np.hstack([best_rows, block_rows + start])
+            candidate_scores = np.hstack([best_scores, np.take_along_axis(block_scores, block_rows, axis=1)])
+            selected = top_k(candidate_scores, k)
+            best_rows = np.take_along_axis(candidate_rows, selected, axis=1)
+            best_scores = np.take_along_axis(candidate_scores, selected, axis=1)
+        return self.item_ids[best_rows], best_scores
+
+
+class IVFIndex():
+    """
+    Approximate top-k retrieval with an inverted file index: the offers are grouped in clusters
+    (k-means on their latent vectors) and only the offers of the n_probe clusters whose centroid has
+    the largest inner product with the query are scored
+    """
+
+    def __init__(self, item_vecs, item_ids, n_clusters=None, n_probe=8, n_iter=20, samples_per_cluster=64,
+                 random_state=42):
+        """
+        Constructor: runs the k-means clustering of the offers
+
+        - Arguments:
+            item_vecs: matrix with the latent vector of each offer (e.g. BPR.item_vecs)
+            item_ids: identifier of each row of item_vecs (e.g. BPR.item_index)
+            n_clusters: number of clusters (by default, the square root of the number of offers)
+            n_probe: number of clusters scored in a search (more clusters: slower but more accurate)
+            n_iter: iterations of the k-means
+            samples_per_cluster: the k-means is trained on a random subsample of at most this number of
+                                 offers per cluster (all the offers are then assigned to a cluster)
+            random_state: seed of the initialization of the k-means
+        """
+        item_vecs = np.asarray(item_vecs)
+        self.item_ids = np.asarray(item_ids)
+        n_items = len(item_vecs)
+        if n_clusters is None:
+            n_clusters = int(np.sqrt(n_items))
+        n_clusters = max(1, min(n_clusters, n_items))
+        self.n_probe = n_probe
+
+        # k-means (Lloyd) on a subsample of the offers, initialized with random offers
+        random_state = np.random.RandomState(random_state)
+        sample = item_vecs[random_state.choice(n_items, min(n_items, samples_per_cluster*n_clusters), replace=False)]
+        centroids = sample[:n_clusters].copy()
+        for _ in range(n_iter):
+            assignment = self.__nearest_centroid__(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_clusters)
+            sums = np.column_stack([np.bincount(assignment, weights=sample[:,d], minlength=n_clusters)
+                                    for d in range(sample.shape[1])])
+            # empty clusters keep their previous centroid
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty]/counts[non_empty][:,None]
+        assignment = self.__nearest_centroid__(item_vecs, centroids)
+        self.centroids = centroids
+
+        # offers sorted by cluster (CSR-style: the offers of cluster c are rows[indptr[c]:indptr[c+1]])
+        self.rows = np.argsort(assignment, kind='stable')
+        self.cluster_vecs = np.ascontiguousarray(item_vecs[self.rows])
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_clusters))])
+
+    @classmethod
+    def from_model(cls, model, **kwargs):
+        """
+        Index of the offers of a trained (or loaded) BPR_MF model
+        """
+        return cls(model.item_vecs, model.item_index, **kwargs)
+
+    def __nearest_centroid__(self, vecs, centroids):
+        """
+        Index of the closest centroid (euclidean distance) of each vector
+        """
+        distances = -2*(vecs @ centroids.T) + np.sum(centroids**2, axis=1)
+        return np.argmin(distances, axis=1)
+
+    def search(self, query_vecs, k=10, n_probe=None):
+        """
+        Approximately best k offers for each query vector
+
+        -Input:
+            query_vecs: matrix of shape (n_queries, num_components) (e.g. the latent vectors of some users)
+            k: number of offers to retrieve
+            n_probe: number of clusters to score (by default, the one given to the constructor)
+
+        -Output:
+            ids: matrix of shape (n_queries, k) with the offer identifiers, sorted by decreasing score
+            scores: matrix of shape (n_queries, k) with their scores
+        """
+        query_vecs = np.atleast_2d(query_vecs)
+        n_probe = n_probe if n_probe is not None else self.n_probe
+        k = min(k, len(self.rows))
+        cluster_sizes = np.diff(self.indptr)
+        # clusters sorted by the inner product of their centroid with the query
+        clusters_order = np.argsort(-(query_vecs @ self.centroids.T), axis=1, kind='stable')
+        ids = np.empty((len(query_vecs), k), dtype=self.item_ids.dtype)
+        scores = np.empty((len(query_vecs), k))
+        for q, clusters in enumerate(clusters_order):
+            # at least n_probe clusters, and more if they do not contain k offers
+            n_clusters = max(n_probe, np.searchsorted(np.cumsum(cluster_sizes[clusters]), k) + 1)
+            candidates = np.concatenate([np.arange(self.indptr[c], self.indptr[c+1]) for c in clusters[:n_clusters]])
+            candidate_scores = self.cluster_vecs[candidates] @ query_vecs[q]
+            selected = top_k(candidate_scores[None,:], k)[0]
+            ids[q] = self.item_ids[self.rows[candidates[selected]]]
+            scores[q] = candidate_scores[selected]
+        return ids, scores
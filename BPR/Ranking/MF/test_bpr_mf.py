@@ -0,0 +1,99 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import synthetic_data
+from BPR_MF import BPR, EvaluationPolicy
+
+
+@pytest.fixture(scope='module')
+def model():
+    return BPR(synthetic_data(n_requests=500, n_users=50, n_items=200, seed=1))
+
+
+def no_metrics():
+    return EvaluationPolicy(n_checkpoints=1, metrics=(), verbose=False)
+
+
+def test_batch_step_sums_single_sample_gradients(model):
+    """A mini-batch step applies the sum of the single-sample updates computed from the same parameters"""
+    batch_size = 64
+    learning_rate = 0.05
+    lmbda = 0.01
+    np.random.seed(0)
+    model.fit(0, learning_rate=learning_rate, lmbda=lmbda, batch_size=batch_size, evaluation=no_metrics())
+    user_vecs = model.user_vecs.copy()
+    item_vecs = model.item_vecs.copy()
+
+    # one batch
+    model.iterations = batch_size
+    model.compute_metrics = batch_size+1
+    np.random.seed(1)
+    model.__sdg__()
+
+    # same triples, single-sample gradients from the initial parameters
+    np.random.seed(1)
+    users, positive_items, negative_items = model.sample_triples(batch_size)
+    expected_user_vecs = user_vecs.copy()
+    expected_item_vecs = item_vecs.copy()
+    for u, i, j in zip(users, positive_items, negative_items):
+        f_ij = max(np.dot(user_vecs[u], item_vecs[i]) - np.dot(user_vecs[u], item_vecs[j]), -10)
+        exponential = np.exp(-f_ij)/(1+np.exp(-f_ij))
+        expected_user_vecs[u] += learning_rate*(exponential*(item_vecs[i]-item_vecs[j]) + lmbda*user_vecs[u])
+        expected_item_vecs[i] += learning_rate*(exponential*user_vecs[u] + lmbda*item_vecs[i])
+        expected_item_vecs[j] += learning_rate*(-exponential*user_vecs[u] + lmbda*item_vecs[j])
+
+    np.testing.assert_allclose(model.user_vecs, expected_user_vecs, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(model.item_vecs, expected_item_vecs, rtol=1e-12, atol=1e-12)
+
+
+def test_single_sample_sgd_is_deterministic(model):
+    """With batch_size=1 the training only depends on the seed of np.random"""
+    results = list()
+    for _ in range(2):
+        np.random.seed(3)
+        model.fit(2000, learning_rate=0.05, batch_size=1,
+                  evaluation=EvaluationPolicy(n_checkpoints=2, metrics=('acu_test',), verbose=False))
+        results.append((model.user_vecs.copy(), model.item_vecs.copy(), list(model.acu_test)))
+    np.testing.assert_array_equal(results[0][0], results[1][0])
+    np.testing.assert_array_equal(results[0][1], results[1][1])
+    assert results[0][2] == results[1][2]
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 500])
+def test_checkpoints_at_interval_boundaries(model, batch_size):
+    """The metrics are computed at every multiple of the checkpoint interval, whatever the batch size"""
+    np.random.seed(0)
+    model.fit(1200, learning_rate=0.05, batch_size=batch_size,
+              evaluation=EvaluationPolicy(metrics=('acu_test',), verbose=False))
+    assert model.metrics_iterations == list(range(100, 1201, 100))
+
+
+def test_keep_data_false_keeps_no_dictionaries():
+    """Without the training data the ids are looked up in sorted arrays, with the same results"""
+    df = synthetic_data(n_requests=500, n_users=50, n_items=200, seed=1)
+    models = list()
+    for keep_data in (True, False):
+        np.random.seed(0)
+        model = BPR(df.copy(), keep_data=keep_data)
+        model.fit(500, learning_rate=0.05, evaluation=no_metrics())
+        models.append(model)
+    full, compact = models
+    for name in ['userid_to_idx', 'itemid_to_idx', 'requestid_to_idx']:
+        assert not isinstance(getattr(compact, name), dict)
+    users, items = df['user_id'].unique()[:5], df['id'].unique()[:5]
+    assert [full.predict(u, i) for u in users for i in items] == [compact.predict(u, i) for u in users for i in items]
+    requests = df['request_id'].unique()[:20]
+    samples = list()
+    for model in models:
+        np.random.seed(2)
+        samples.append([model.sample_offer_not_picked(r) for r in requests])
+    assert samples[0] == samples[1]
+
+
+def test_early_stopping_requires_test_auc():
+    """The early stopping can not be silently ignored"""
+    with pytest.raises(ValueError):
+        EvaluationPolicy(metrics=('acu_train',), patience=2)
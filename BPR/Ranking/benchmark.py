@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+##############################################################################
+# This script measures the speed and memory of the BPR models on synthetic data
+# with the same schema as the categorized offers
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from bpr_base import EvaluationPolicy
+
+CATEGORIES = ['Quick', 'Reliable', 'Cheap', 'Comfortable', 'D2D', 'Env_Friendly', 'Short',
+              'Multitasking', 'Social', 'Panoramic', 'Healthy']
+
+
+def synthetic_data(n_requests=10000, n_users=1000, n_items=5000, max_offers=10, seed=0):
+    """
+    Generate mobility requests with the schema of the categorized offers
+    Inputs:
+    - n_requests: number of mobility requests
+    - n_users: number of users (each request belongs to a random user)
+    - n_items: number of distinct offers seen across requests (column 'id', used by the MF model)
+    - max_offers: maximum number of offers of a request (each request has between 2 and max_offers)
+    - seed: seed of the generator
+    Outputs:
+    - df: dataframe with columns request_id, user_id, id, offer_id, the 11 categories and Response
+      (exactly one chosen offer per request, the one with the largest sum of categories plus noise)"""
+    random_state = np.random.RandomState(seed)
+    n_offers = random_state.randint(2, max_offers+1, size=n_requests)
+    n_rows = n_offers.sum()
+    request = np.repeat(np.arange(n_requests), n_offers)
+    df = pd.DataFrame({'request_id': pd.Series(request).map('#{}:0'.format).values,
+                       'user_id': random_state.randint(n_users, size=n_requests)[request],
+                       'id': random_state.randint(n_items, size=n_rows),
+                       'offer_id': np.arange(n_rows)})
+    categories = random_state.random_sample((n_rows, len(CATEGORIES)))
+    for c, category in enumerate(CATEGORIES):
+        df[category] = categories[:, c]
+    # chosen offer: best utility within its request
+    utility = categories.sum(axis=1) + random_state.normal(size=n_rows)
+    order = np.lexsort((-utility, request))
+    first = np.concatenate([[0], np.cumsum(n_offers)[:-1]])
+    response = np.zeros(n_rows, dtype=np.int64)
+    response[order[first]] = 1
+    df['Response'] = response
+    return df
+
+
+def _measure(function, memory):
+    """
+    Run a function and return its result, its time and (if memory) its peak of allocated memory in MB
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def benchmark(module, df, iterations=1e5, ks=(1, 5, 10), memory=True, seed=0, dtype=np.float64, **fit_kwargs):
+    """
+    Measure the constructor, the training and the evaluation of a BPR model
+    Inputs:
+    - module: BPR_MF or BPR_FM module
+    - df: dataframe with the data (e.g. returned by synthetic_data)
+    - iterations: number of SGD iterations of the training
+    - ks: list containing the different 'k' to evaluate the Recall@k
+    - memory: also measure the peak memory of each phase (with tracemalloc, in a separate run of the
+      phase since tracing the allocations slows it down). The memory of the training is measured on
+      at most 10000 iterations (one block of sampled triples), since it does not grow with them
+    - seed: seed of the initialization and sampling of the training
+    - dtype: floating point type of the parameters of the model
+    - fit_kwargs: other arguments of fit (e.g. learning_rate, batch_size, n_jobs)
+    Outputs:
+    - result: dictionary with the time (seconds) and peak memory (MB) of each phase and the SGD steps per second"""
+    no_metrics = EvaluationPolicy(n_checkpoints=1, metrics=(), verbose=False)
+
+    def construct():
+        return module.BPR(df, dtype=dtype)
+
+    def train(iterations=iterations):
+        np.random.seed(seed)
+        model.fit(single_iterations=iterations, evaluation=no_metrics, **fit_kwargs)
+
+    def evaluate():
+        model.compute_ACU(model.reduced_test)
+        model.metrics(model.test, list(ks))
+
+    model, constructor_time, _ = _measure(construct, False)
+    _, fit_time, _ = _measure(train, False)
+    _, evaluation_time, _ = _measure(evaluate, False)
+    result = {'model': module.__name__,
+              'rows': len(df),
+              'constructor_time': constructor_time,
+              'fit_time': fit_time,
+              'steps_per_second': int(iterations)/fit_time,
+              'evaluation_time': evaluation_time}
+    if memory:
+        model, _, result['constructor_peak_mb'] = _measure(construct, True)
+        _, _, result['fit_peak_mb'] = _measure(lambda: train(min(iterations, 10000)), True)
+        _, _, result['evaluation_peak_mb'] = _measure(evaluate, True)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model',
+                        nargs='+', choices=['mf', 'fm'], default=['mf', 'fm'],
+                        help='Models to benchmark [default: mf fm].')
+    parser.add_argument('-n', '--requests',
+                        nargs='+', type=int, default=[10000],
+                        help='Number of mobility requests of the synthetic data, one benchmark per value [default: 10000].')
+    parser.add_argument('-u', '--users',
+                        type=int, default=1000,
+                        help='Number of users [default: 1000].')
+    parser.add_argument('--items',
+                        type=int, default=5000,
+                        help='Number of distinct offer ids (MF items) [default: 5000].')
+    parser.add_argument('--max-offers',
+                        type=int, default=10,
+                        help='Maximum number of offers per request [default: 10].')
+    parser.add_argument('-i', '--iterations',
+                        type=float, default=1e5,
+                        help='SGD iterations of each training [default: 1e5].')
+    parser.add_argument('-l', '--learning-rate',
+                        type=float, default=0.0005,
+                        help='Learning rate [default: 0.0005].')
+    parser.add_argument('-b', '--batch-size',
+                        type=int, default=1,
+                        help='Batch size of the MF training [default: 1].')
+    parser.add_argument('-j', '--jobs',
+                        type=int, default=1,
+                        help='Number of training processes [default: 1].')
+    parser.add_argument('--float32',
+                        action='store_true',
+                        help='Store the parameters of the models as float32.')
+    parser.add_argument('--no-memory',
+                        action='store_true',
+                        help='Do not measure the peak memory (faster).')
+    parser.add_argument('-o', '--output',
+                        default=None,
+                        help='Csv file where the results table is written.')
+
+    args = parser.parse_args()
+
+    ranking_dir = os.path.dirname(os.path.abspath(__file__))
+    modules = dict()
+    for name in args.model:
+        model_dir = {'mf': 'MF', 'fm': 'FM'}[name]
+        sys.path.insert(0, os.path.join(ranking_dir, model_dir))
+        modules[name] = importlib.import_module('BPR_{}'.format(model_dir))
+
+    results = list()
+    for n_requests in args.requests:
+        print('Generating {} requests...'.format(n_requests), file=sys.stderr, flush=True)
+        df = synthetic_data(n_requests=n_requests, n_users=args.users, n_items=args.items,
+                            max_offers=args.max_offers)
+        for name, module in modules.items():
+            print('Benchmarking {}...'.format(module.__name__), file=sys.stderr, flush=True)
+            fit_kwargs = {'learning_rate': args.learning_rate, 'n_jobs': args.jobs}
+            if name == 'mf':
+                fit_kwargs['batch_size'] = args.batch_size
+            result = benchmark(module, df, iterations=args.iterations, memory=not args.no_memory,
+                               dtype=np.float32 if args.float32 else np.float64, **fit_kwargs)
+            result['requests'] = n_requests
+            results.append(result)
+    results = pd.DataFrame(results)
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+    print(results.to_string(index=False))
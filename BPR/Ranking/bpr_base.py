@@ -0,0 +1,824 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+##############################################################################
+# Parts of the BPR training shared by the underlying models (MF and FM): train/test
+# split, triple store, evaluation schedule, parallel SGD and metrics. The models
+# only implement their parameters, their scores and their SGD step
+
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from math import ceil
+from multiprocessing import shared_memory
+
+
+class EvaluationPolicy():
+    """
+    Evaluation schedule used during the training of a BPR model
+    """
+
+    def __init__(self, n_checkpoints=None, interval=None,
+                 metrics=('acu_test', 'acu_train', 'ranking_train', 'ranking_test'), ks=(1,5,10),
+                 train_subsample=None, patience=None, min_delta=0.0, verbose=True, random_state=42):
+        """
+        Constructor
+
+        - Arguments:
+            n_checkpoints: number of checkpoints along the training (ignored if interval is given).
+                           If None, the default of the model is used
+            interval: number of iterations between two checkpoints
+            metrics: metrics computed at each checkpoint, among 'acu_test', 'acu_train' (AUC)
+                     and 'ranking_train', 'ranking_test' (Recall@k, MAP and position bias)
+            ks: list containing the different 'k' to evaluate the Recall@k
+            train_subsample: if given, the train metrics are computed on a fixed random subsample of
+                             this number of mobility requests (drawn once at the beginning of the training)
+            patience: if given, the training stops when the test AUC has not improved by more than
+                      min_delta during this number of checkpoints (requires 'acu_test' in metrics)
+            min_delta: minimum improvement of the test AUC for the early stopping
+            verbose: print the progress at each checkpoint
+            random_state: seed of the train subsample
+        """
+        if patience is not None and 'acu_test' not in metrics:
+            raise ValueError("patience requires 'acu_test' in metrics")
+        self.n_checkpoints = n_checkpoints
+        self.interval = interval
+        self.metrics = metrics
+        self.ks = list(ks)
+        self.train_subsample = train_subsample
+        self.patience = patience
+        self.min_delta = min_delta
+        self.verbose = verbose
+        self.random_state = random_state
+
+    def checkpoint_interval(self, iterations, default_checkpoints):
+        """
+        Number of iterations between two checkpoints
+        """
+        if self.interval is not None:
+            return max(1, int(self.interval))
+        n_checkpoints = self.n_checkpoints if self.n_checkpoints is not None else default_checkpoints
+        return max(1, int(iterations/n_checkpoints))
+
+    def train_sample(self, reduced_train, train):
+        """
+        Restrict the train sets (positive samples and complete requests) to the subsample of mobility requests
+        """
+        requests = reduced_train.request_id.unique()
+        if self.train_subsample is None or len(requests) <= self.train_subsample:
+            return reduced_train, train
+        requests = np.random.RandomState(self.random_state).choice(requests, self.train_subsample, replace=False)
+        return reduced_train[reduced_train.request_id.isin(requests)], train[train.request_id.isin(requests)]
+
+    def should_stop(self, acu_test):
+        """
+        Early stopping: True if the best test AUC of the last 'patience' checkpoints does not improve
+        the best previous one by more than min_delta
+        """
+        if self.patience is None or len(acu_test) <= self.patience:
+            return False
+        return max(acu_test[-self.patience:]) <= max(acu_test[:-self.patience]) + self.min_delta
+
+
+class IdIndex():
+    """
+    Identifiers of the rows of the parameters of a saved model (or of a model constructed with keep_data=False),
+    stored as the sorted identifiers and the row of each one, and looked up by binary search. The arrays can be memory-mapped, so that a serving
+    process opens a model without building dictionaries or indexes from the identifiers. It can be used
+    as a dictionary from identifier to row (get, in) and as an index (get_indexer, ids[rows])
+    """
+
+    def __init__(self, sorted_ids, rows):
+        """
+        Constructor
+
+        - Arguments:
+            sorted_ids: array with the identifiers in increasing order
+            rows: array with the row of each identifier of sorted_ids
+        """
+        self.sorted_ids = sorted_ids
+        self.rows = rows
+        # identifiers in the order of the rows (only built if needed)
+        self.row_ids = None
+
+    @classmethod
+    def from_ids(cls, ids):
+        """
+        Index of the given identifiers (the identifier of row i is ids[i])
+        """
+        ids = np.asarray(ids)
+        rows = np.argsort(ids, kind='stable')
+        return cls(ids[rows], rows)
+
+    @classmethod
+    def load(cls, path, name, mmap_mode=None):
+        """
+        Load the index written by save() in path (or an array of identifiers in the order of the rows)
+        """
+        sorted_ids = np.load(os.path.join(path, '{}_ids.npy'.format(name)), mmap_mode=mmap_mode)
+        rows_file = os.path.join(path, '{}_rows.npy'.format(name))
+        if not os.path.exists(rows_file):
+            return cls.from_ids(sorted_ids)
+        return cls(sorted_ids, np.load(rows_file, mmap_mode=mmap_mode))
+
+    def save(self, path, name):
+        """
+        Write the sorted identifiers and their rows in path ({name}_ids.npy and {name}_rows.npy)
+        """
+        np.save(os.path.join(path, '{}_ids.npy'.format(name)), self.sorted_ids)
+        np.save(os.path.join(path, '{}_rows.npy'.format(name)), self.rows)
+
+    def get_indexer(self, values):
+        """
+        Rows of the given identifiers (-1 for unknown identifiers)
+        """
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = np.asarray(values.tolist())
+        indexer = np.full(len(values), -1, dtype=np.int64)
+        numeric = 'biuf'
+        if len(self.sorted_ids) == 0 or (values.dtype.kind in numeric) != (self.sorted_ids.dtype.kind in numeric):
+            return indexer
+        position = np.minimum(np.searchsorted(self.sorted_ids, values), len(self.sorted_ids)-1)
+        found = self.sorted_ids[position] == values
+        indexer[found] = self.rows[position[found]]
+        return indexer
+
+    def get(self, value, default=None):
+        """
+        Row of an identifier (default if it is unknown)
+        """
+        position = np.searchsorted(self.sorted_ids, value)
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == value:
+            return self.rows[position]
+        return default
+
+    def __contains__(self, value):
+        return self.get(value) is not None
+
+    def append(self, ids):
+        """
+        Index with the given identifiers added after the last row (the identifier of row len(self)+i is ids[i])
+        """
+        if len(ids) == 0:
+            return self
+        return IdIndex.from_ids(np.concatenate([self.ids(), np.asarray(ids)]))
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    def ids(self):
+        """
+        Identifiers in the order of the rows
+        """
+        if self.row_ids is None:
+            self.row_ids = np.empty(len(self.sorted_ids), dtype=self.sorted_ids.dtype)
+            self.row_ids[self.rows] = self.sorted_ids
+        return self.row_ids
+
+    def __getitem__(self, rows):
+        return self.ids()[rows]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.ids(), dtype=dtype)
+
+    def tolist(self):
+        return self.ids().tolist()
+
+
+def hogwild_worker(model, shared, seed):
+    """
+    Worker of the parallel training: runs the SGD of a copy of the model (without the training data)
+    whose parameters are the arrays in shared memory, updating them without locks (Hogwild!)
+
+    - Arguments:
+        model: copy of the model returned by BPRBase.__worker_model__
+        shared: dictionary from array name (parameters and worker arrays) to (shared memory name, shape, dtype)
+        seed: seed of the random sampling of the worker
+    """
+    blocks = list()
+    for name, (shm_name, shape, dtype) in shared.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        setattr(model, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    np.random.seed(seed)
+    model.__sdg__()
+    for name in shared:
+        setattr(model, name, None)
+    for shm in blocks:
+        shm.close()
+
+
+class BPRBase():
+    """
+    Bayesian Personalized Ranking, independently of the underlying model
+
+    The models (BPR_MF.BPR, BPR_FM.BPR) define:
+        offer_column: column of the dataframe identifying the offers scored by the model
+        parameter_names: arrays updated by the SGD (moved to shared memory by the parallel training)
+        user_index_names, offer_index_names: names of the dictionary from identifier to row and of the index of
+                                             the identifiers of the rows of users and offers in the parameters
+        worker_attributes: other attributes needed by the SGD of a worker
+        __worker_arrays__, __merge_workers__: state of the workers of the parallel training merged by the
+                                             main process (see __sdg_parallel__)
+        default_checkpoints: number of checkpoints of the training if the evaluation policy does not set it
+        __user_rows__, __offer_rows__: indices of users and offers in the parameters (-1 if unknown)
+        __add_users_and_offers__: add the users and offers of new mobility requests (see partial_fit)
+        __sdg__: Stochastic Gradient Descent
+        __score_pairs__: prediction scores of (user, offer) pairs given by their indices
+    """
+
+    offer_column = 'offer_id'
+    parameter_names = []
+    user_index_names = ('userid_to_index', 'user_index')
+    offer_index_names = ('offerid_2_index', 'offer_index')
+    worker_attributes = []
+    default_checkpoints = 10
+    # index of the worker of the parallel training running the SGD (None in the main process)
+    worker = None
+
+    def __split__(self):
+        """
+        Split the positive samples of df into a train and a test set (a fraction test_size of the chosen
+        offers of each user with more than 2), and build the dictionaries from request to offers
+        """
+        # separate positive and negative samples
+        positive_df = self.df[self.df['Response']==1].reset_index().drop('index', axis=1)
+        negative_df = self.df[self.df['Response']==0].reset_index().drop('index', axis=1)
+        # instances of the class
+        self.positive = positive_df
+        self.negative = negative_df
+
+
+        # creation of train and test sets (only positive samples)
+        test_index = list()
+        for u, user_df in self.positive.groupby('user_id', sort=False):
+            if len(user_df)>2:
+                test_samples = user_df.sample(n=ceil(self.test_size*len(user_df)), random_state=42, replace=False)
+                test_index.extend(test_samples.index)
+        reduced_train = self.positive.drop(test_index)
+        reduced_test = self.positive.loc[test_index]
+        reduced_train = reduced_train.reset_index().drop('index', axis=1)
+        reduced_test = reduced_test.reset_index().drop('index', axis=1)
+        self.reduced_train = reduced_train
+        self.reduced_test = reduced_test
+
+        # complete train (with positive and negative samples)
+        self.train = self.__requests_data__(self.reduced_train.request_id.unique())
+
+        # complete the test (with positive and negative samples)
+        self.test = self.__requests_data__(self.reduced_test.request_id.unique())
+
+        # dictionary from request id to negative offers id
+        self.requestid_2_offerid_negative = self.negative.groupby('request_id', sort=False)[self.offer_column].agg(list).to_dict()
+
+        # dictionary from request id to positive offers id
+        self.requestid_2_offerid_positive = self.positive.groupby('request_id', sort=False)[self.offer_column].agg(list).to_dict()
+
+    def __release_data__(self):
+        """
+        With keep_data=False, encode the train and test sets for all the metrics and drop the dataframes.
+        The dictionaries from identifier to row are replaced by IdIndex (sorted arrays, as in load)
+        """
+        if not self.keep_data:
+            # train and test sets encoded for all the metrics, then the dataframes are released
+            self.evaluation_data = self.__evaluation_data__(('acu_test','acu_train','ranking_train','ranking_test'),
+                                                            self.reduced_train, self.train)
+            for name in ['df', 'positive', 'negative', 'reduced_train', 'reduced_test', 'train', 'test',
+                         'requestid_2_offerid_negative', 'requestid_2_offerid_positive']:
+                delattr(self, name)
+            for dictionary_name, index_name in (self.user_index_names, self.offer_index_names):
+                index = IdIndex.from_ids(getattr(self, index_name).tolist())
+                setattr(self, index_name, index)
+                setattr(self, dictionary_name, index)
+            self.requestid_to_idx = IdIndex.from_ids(list(self.requestid_to_idx))
+
+    def __requests_data__(self, requests):
+        """
+        Rows of the dataframe (positive and negative samples) belonging to the given mobility requests,
+        grouped by request in the given order
+        """
+        request_order = pd.Series(np.arange(len(requests)), index=requests)
+        requests_df = self.df[self.df['request_id'].isin(requests)]
+        return requests_df.iloc[np.argsort(requests_df['request_id'].map(request_order).values, kind='stable')]
+
+    def __build_triple_store__(self):
+        """
+        Encode the train set as integer arrays so that (u, i, j) triples can be sampled with NumPy
+
+        - triple_users, triple_offers, triple_requests: index of the user and of the positive offer
+          in the parameters, and index of the mobility request, for each positive sample of the train set
+        - negative_indptr, negative_offers: CSR-style arrays with the indices of the negative offers
+          of each mobility request (only offers known by the model)
+        Positive samples whose request has no such negative offer are left out, since no triple can
+        be formed with them.
+        """
+        requests = self.df['request_id'].unique()
+        self.requestid_to_idx = dict(zip(requests, range(len(requests))))
+        (self.triple_users, self.triple_offers, self.triple_requests,
+         self.negative_indptr, self.negative_offers) = self.__encode_triples__(self.reduced_train, self.negative, requests)
+
+    def __encode_triples__(self, positive, negative, requests):
+        """
+        Integer-encoded triples of the given positive samples and CSR-style arrays with the negative
+        offers of the given mobility requests (the request indices are positions in 'requests')
+        """
+        request_to_idx = pd.Series(np.arange(len(requests)), index=requests)
+
+        # negative offers grouped by request (offers unknown by the model can not be sampled)
+        negative_offers = self.__offer_rows__(negative[self.offer_column])
+        trainable = negative_offers >= 0
+        negative_requests = negative['request_id'].map(request_to_idx).values[trainable].astype(np.int64)
+        negative_offers = negative_offers[trainable].astype(np.int64)
+        order = np.argsort(negative_requests, kind='stable')
+        n_negatives = np.bincount(negative_requests, minlength=len(requests))
+        negative_indptr = np.concatenate([[0], np.cumsum(n_negatives)])
+
+        # positive samples
+        triple_requests = positive['request_id'].map(request_to_idx).values.astype(np.int64)
+        has_negative = n_negatives[triple_requests] > 0
+        triple_users = self.__user_rows__(positive['user_id'])[has_negative].astype(np.int64)
+        triple_offers = self.__offer_rows__(positive[self.offer_column])[has_negative].astype(np.int64)
+        return triple_users, triple_offers, triple_requests[has_negative], negative_indptr, negative_offers[order]
+
+    def sample_triples(self, n):
+        """
+        Sample a batch of training triples (user, positive offer, negative offer of the same request)
+
+        -Input:
+            n: number of triples to sample
+
+        -Output:
+            users, positive_offers, negative_offers: arrays with the indices of each triple
+        """
+        samples = np.random.randint(len(self.triple_users), size=n)
+        requests = self.triple_requests[samples]
+        start = self.negative_indptr[requests]
+        n_negatives = self.negative_indptr[requests+1] - start
+        offsets = (np.random.random(n)*n_negatives).astype(np.int64)
+        return self.triple_users[samples], self.triple_offers[samples], self.negative_offers[start+offsets]
+
+    def sample_offer_not_picked(self,request_id):
+        """
+        Sample a negative offer from a given mobility requests
+
+        -Input:
+            request_id: mobility request identifier
+
+        -Output:
+            sampled_offer: negative offer from the mobility request (only offers known by the model
+            are sampled). None if the request has no such offer
+        """
+        request_idx = self.requestid_to_idx.get(request_id)
+        if request_idx is None:
+            raise KeyError(request_id)
+        start = self.negative_indptr[request_idx]
+        n_negatives = self.negative_indptr[request_idx+1] - start
+        if n_negatives == 0:
+            return None
+        offer_index = getattr(self, self.offer_index_names[1])
+        return offer_index[self.negative_offers[start + np.random.randint(n_negatives)]]
+
+    def __train__(self, single_iterations, learning_rate, lmbda, evaluation, n_jobs):
+        """
+        Set the hyperparameters and the evaluation of a training (see fit), encode the train and test sets
+        for the metrics and run the SGD from the initialized parameters
+        """
+        self.learning_rate = learning_rate
+        self.lmbda = lmbda
+        self.iterations = int(single_iterations)
+        self.n_jobs = int(n_jobs)
+        self.evaluation = evaluation if evaluation is not None else EvaluationPolicy()
+        self.compute_metrics = self.evaluation.checkpoint_interval(self.iterations, self.default_checkpoints)
+        # spare capacity of the parameters for the new users and offers of partial_fit
+        self.parameter_buffers = dict()
+
+        # lists to store the metrics (to follow the training process)
+        self.acu_test = list()
+        self.acu_train = list()
+        self.metrics_iterations = list()
+        self.recall_at_k_train = list()
+        self.recall_at_k_test = list()
+        self.MAP_train = list()
+        self.MAP_test = list()
+        self.pos_bias_train = list()
+        self.pos_bias_test = list()
+        # train and test sets encoded once for the metrics
+        if self.keep_data:
+            reduced_train, train = self.evaluation.train_sample(self.reduced_train, self.train)
+            evaluation_data = self.__evaluation_data__(self.evaluation.metrics, reduced_train, train)
+        elif self.evaluation.train_subsample is not None:
+            raise ValueError('train_subsample requires a model constructed with keep_data=True')
+        else:
+            evaluation_data = self.evaluation_data
+        self.train_auc = evaluation_data.get('acu_train')
+        self.test_auc = evaluation_data.get('acu_test')
+        self.train_ranking = evaluation_data.get('ranking_train')
+        self.test_ranking = evaluation_data.get('ranking_test')
+
+        if self.n_jobs > 1:
+            self.__sdg_parallel__()
+        else:
+            self.__sdg__()
+
+    def __sdg_parallel__(self):
+        """
+        Parallel Stochastic Gradient Descent (Hogwild!)
+
+        The parameters are moved to shared memory and n_jobs worker processes sample triples and
+        update them without locks. The workers are started again after each checkpoint, which is
+        computed by this process once they have finished and their state has been merged
+        (__merge_workers__). The parameters updated at every step (e.g. the rows of the categories of
+        the FM model) are written by all the workers at the same time
+        """
+        context = multiprocessing.get_context()
+        shared = dict()
+        blocks = list()
+        worker_arrays = self.__worker_arrays__()
+        for name in self.parameter_names + list(worker_arrays):
+            array = worker_arrays[name] if name in worker_arrays else getattr(self, name)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(shm)
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared_array[:] = array
+            setattr(self, name, shared_array)
+            shared[name] = (shm.name, array.shape, array.dtype.str)
+        try:
+            i = 0
+            j = 1
+            while i < self.iterations:
+                # iterations until the next checkpoint, split among the workers
+                segment = min(self.compute_metrics - i%self.compute_metrics, self.iterations-i)
+                workers = list()
+                try:
+                    for w in range(self.n_jobs):
+                        worker_iterations = segment//self.n_jobs + int(w < segment%self.n_jobs)
+                        if worker_iterations == 0:
+                            continue
+                        worker = context.Process(target=hogwild_worker,
+                                                 args=(self.__worker_model__(worker_iterations, w), shared,
+                                                       np.random.randint(2**31)))
+                        worker.start()
+                        workers.append(worker)
+                    for worker in workers:
+                        worker.join()
+                finally:
+                    # no worker can be left writing to the shared memory once it is released
+                    for worker in workers:
+                        if worker.is_alive():
+                            worker.terminate()
+                        worker.join()
+                exitcodes = [worker.exitcode for worker in workers if worker.exitcode != 0]
+                if len(exitcodes) > 0:
+                    raise RuntimeError('Training worker failed with exit code {}'.format(exitcodes[0]))
+                self.__merge_workers__()
+                i += segment
+                if i%self.compute_metrics==0:
+                    stop = self.__checkpoint__(i, j)
+                    j += 1
+                    if stop:
+                        break
+        finally:
+            # copy the parameters back to private memory and release the shared memory
+            for name in self.parameter_names:
+                setattr(self, name, np.array(getattr(self, name)))
+            for name in worker_arrays:
+                delattr(self, name)
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def __worker_arrays__(self):
+        """
+        Arrays shared with the workers, besides the parameters, to be read by __merge_workers__
+        (dictionary from attribute name to initial value)
+        """
+        return dict()
+
+    def __merge_workers__(self):
+        """
+        Merge the state left by the workers of the parallel training, after they have finished
+        and before the next checkpoint
+        """
+        pass
+
+    def __worker_model__(self, iterations, w):
+        """
+        Copy of the model with what the SGD of the worker w needs (sampling arrays and hyperparameters),
+        without the training data and the parameters
+        """
+        worker = self.__class__.__new__(self.__class__)
+        for name in ['learning_rate', 'lmbda', 'triple_users', 'triple_offers', 'triple_requests',
+                     'negative_indptr', 'negative_offers'] + self.worker_attributes:
+            setattr(worker, name, getattr(self, name))
+        worker.iterations = iterations
+        worker.compute_metrics = iterations+1
+        worker.worker = w
+        return worker
+
+    def __checkpoint__(self, i, j):
+        """
+        Compute and store the metrics of the model at iteration i (j-th checkpoint)
+
+        -Output:
+            True if the training has to stop (early stopping)
+        """
+        evaluation = self.evaluation
+        self.metrics_iterations.append(i)
+        if evaluation.verbose:
+            print('{}/{}'.format(j, int(self.iterations/self.compute_metrics)))
+            print('Computing metrics...')
+        # accuracy test
+        if 'acu_test' in evaluation.metrics:
+            acu_test = self.compute_ACU(self.test_auc)
+            self.acu_test.append(acu_test)
+        # accuracy train
+        if 'acu_train' in evaluation.metrics:
+            acu_train = self.compute_ACU(self.train_auc)
+            self.acu_train.append(acu_train)
+        # recall and MAP train
+        if 'ranking_train' in evaluation.metrics:
+            recall_at_k_train, MAP_train, pos_bias_train = self.metrics(self.train_ranking, evaluation.ks)
+            self.recall_at_k_train.append(recall_at_k_train)
+            self.MAP_train.append(MAP_train)
+            self.pos_bias_train.append(pos_bias_train)
+            if evaluation.verbose:
+                print('Metrics for train completed')
+        # recall and MAP test
+        if 'ranking_test' in evaluation.metrics:
+            recall_at_k_test, MAP_test, pos_bias_test = self.metrics(self.test_ranking, evaluation.ks)
+            self.recall_at_k_test.append(recall_at_k_test)
+            self.MAP_test.append(MAP_test)
+            self.pos_bias_test.append(pos_bias_test)
+            if evaluation.verbose:
+                print('Metrics for test completed')
+        stop = evaluation.should_stop(self.acu_test)
+        if stop and evaluation.verbose:
+            print('Early stopping at iteration {}'.format(i))
+        return stop
+
+    def __evaluation_data__(self, metrics, reduced_train, train):
+        """
+        Encode the train and test sets for the given metrics (see auc_data and ranking_data)
+
+        -Output:
+            dictionary from metric name to the encoding of its dataset
+        """
+        evaluation_data = dict()
+        if 'acu_train' in metrics:
+            evaluation_data['acu_train'] = self.auc_data(reduced_train)
+        if 'acu_test' in metrics:
+            evaluation_data['acu_test'] = self.auc_data(self.reduced_test)
+        if 'ranking_train' in metrics:
+            evaluation_data['ranking_train'] = self.ranking_data(train)
+        if 'ranking_test' in metrics:
+            evaluation_data['ranking_test'] = self.ranking_data(self.test)
+        return evaluation_data
+
+    def partial_fit(self, new_rows, iterations=None, learning_rate=None, lmbda=None):
+        """
+        Update the trained model with newly observed mobility requests, without training it again from scratch
+
+        The new users and offers are added to the model (see __add_users_and_offers__), and a bounded
+        number of SGD steps is run on the triples of the new requests only. The train and test sets
+        used by the metrics are not modified
+
+        -Input:
+            new_rows: pandas dataframe with the same columns as df and complete mobility requests
+                      (chosen offer and negative offers)
+            iterations: number of SGD steps (by default, 10 per new positive sample)
+            learning_rate: hyperparameter of the SGD (by default, the one of the last training)
+            lmbda: regularizer of the SGD (by default, the one of the last training)
+        """
+        positive = new_rows[new_rows['Response']==1]
+        negative = new_rows[new_rows['Response']==0]
+
+        # dictionaries from request id to offers id
+        if self.keep_data:
+            for requestid, offers in negative.groupby('request_id', sort=False)[self.offer_column].agg(list).items():
+                self.requestid_2_offerid_negative.setdefault(requestid, list()).extend(offers)
+            for requestid, offers in positive.groupby('request_id', sort=False)[self.offer_column].agg(list).items():
+                self.requestid_2_offerid_positive.setdefault(requestid, list()).extend(offers)
+
+        self.__add_users_and_offers__(new_rows, positive)
+
+        # triples of the new requests, appended to the triple store
+        n_requests = len(self.negative_indptr) - 1
+        requests = new_rows['request_id'].unique()
+        if self.keep_data:
+            self.requestid_to_idx.update(zip(requests, range(n_requests, n_requests+len(requests))))
+        else:
+            self.requestid_to_idx = self.requestid_to_idx.append(requests)
+        users, offers, triple_requests, negative_indptr, negative_offers = self.__encode_triples__(positive, negative, requests)
+        self.negative_indptr = np.concatenate([self.negative_indptr, negative_indptr[1:] + self.negative_indptr[-1]])
+        self.negative_offers = np.concatenate([self.negative_offers, negative_offers])
+        triple_requests += n_requests
+
+        # SGD on the new triples only
+        if len(users) > 0:
+            previous = (self.triple_users, self.triple_offers, self.triple_requests, self.iterations,
+                        self.compute_metrics, self.learning_rate, self.lmbda)
+            self.triple_users, self.triple_offers, self.triple_requests = users, offers, triple_requests
+            self.iterations = int(iterations) if iterations is not None else 10*len(users)
+            self.compute_metrics = self.iterations+1
+            if learning_rate is not None:
+                self.learning_rate = learning_rate
+            if lmbda is not None:
+                self.lmbda = lmbda
+            try:
+                self.__sdg__()
+            finally:
+                (self.triple_users, self.triple_offers, self.triple_requests, self.iterations,
+                 self.compute_metrics, self.learning_rate, self.lmbda) = previous
+        self.triple_users = np.concatenate([self.triple_users, users])
+        self.triple_offers = np.concatenate([self.triple_offers, offers])
+        self.triple_requests = np.concatenate([self.triple_requests, triple_requests])
+
+    def __append_ids__(self, index_names, new_ids):
+        """
+        Add new identifiers after the last row of the dictionary and of the index given by index_names
+        (user_index_names or offer_index_names)
+        """
+        dictionary_name, index_name = index_names
+        index = getattr(self, index_name)
+        if self.keep_data:
+            getattr(self, dictionary_name).update(zip(new_ids, range(len(index), len(index)+len(new_ids))))
+            setattr(self, index_name, index.append(pd.Index(new_ids)))
+        else:
+            index = index.append(new_ids)
+            setattr(self, index_name, index)
+            setattr(self, dictionary_name, index)
+
+    def __insert_rows__(self, name, position, rows):
+        """
+        Insert rows in a parameter array (e.g. the parameters of new users) at the given position
+
+        The array is a view of a larger buffer, which is only reallocated (doubling its capacity)
+        when it is full, so that adding rows one request at a time has an amortized constant cost
+        (only the rows after the position are moved)
+        """
+        if len(rows) == 0:
+            return
+        array = getattr(self, name)
+        n_rows = len(array) + len(rows)
+        buffer = self.parameter_buffers.get(name)
+        if buffer is None or array.base is not buffer or len(buffer) < n_rows:
+            buffer = np.empty((max(n_rows, 2*len(array)),) + array.shape[1:], dtype=array.dtype)
+            buffer[:len(array)] = array
+            self.parameter_buffers[name] = buffer
+        # rows after the position are shifted
+        buffer[position+len(rows):n_rows] = buffer[position:len(array)].copy()
+        buffer[position:position+len(rows)] = rows
+        setattr(self, name, buffer[:n_rows])
+
+    def compute_ACU(self,data):
+        """
+        Compute the AUC: fraction of negative offers ranked below the chosen offer, averaged over
+        the mobility requests
+
+        -Input:
+            data: pandas dataframe with the positive samples to evaluate (e.i. reduced train or test set),
+                  or its encoding returned by auc_data()
+
+        -Output:
+            AUC
+        """
+        if isinstance(data, pd.DataFrame):
+            data = self.auc_data(data)
+        positive_scores = self.__score_pairs__(data['user_idx'], data['offer_idx'])
+        negative_scores = self.__score_pairs__(data['negative_user_idx'], data['negative_offer_idx'])
+        fractions = self.auc(positive_scores, negative_scores, data['negative_indptr'])
+        return np.sum(fractions)/data['n_requests']
+
+    def auc(self, positive_scores, negative_scores, negative_indptr):
+        """
+        Fraction of negative offers scored below the positive offer, for each mobility request
+
+        -Input:
+            positive_scores: array with the score of the chosen offer of each request
+            negative_scores: array with the scores of the negative offers of all requests, request after request
+            negative_indptr: CSR-style array, the negative scores of request r are
+                             negative_scores[negative_indptr[r]:negative_indptr[r+1]]
+
+        -Output:
+            fractions: array with the fraction of each request (0.0 for requests without negative offers)
+        """
+        n_negatives = np.diff(negative_indptr)
+        request = np.repeat(np.arange(len(positive_scores)), n_negatives)
+        above = np.bincount(request, weights=positive_scores[request] > negative_scores,
+                            minlength=len(positive_scores))
+        return np.divide(above, n_negatives, out=np.zeros(len(positive_scores)), where=n_negatives > 0)
+
+    def auc_data(self, data):
+        """
+        Encode a dataset for the AUC, so that it can be evaluated several times without going
+        through the dataframe again
+
+        -Input:
+            data: pandas dataframe with the positive samples to evaluate (e.i. reduced train or test set)
+
+        -Output:
+            dictionary of arrays: user_idx and offer_idx of the chosen offer of each (user, mobility request),
+            negative_user_idx, negative_offer_idx and negative_indptr (CSR-style) for its negative offers,
+            and n_requests (number of distinct requests in data)
+        """
+        offer_column = self.offer_column
+        positives = data[['user_id','request_id',offer_column]].drop_duplicates(['user_id','request_id'])
+        positives = positives.reset_index(drop=True).reset_index()
+        negatives = positives[['index','user_id','request_id']].merge(self.negative[['request_id',offer_column]],
+                                                                     on='request_id')
+        negatives = negatives.iloc[np.argsort(negatives['index'].values, kind='stable')]
+        n_negatives = np.bincount(negatives['index'].values, minlength=len(positives))
+        return {'user_idx': self.__user_rows__(positives['user_id']),
+                'offer_idx': self.__offer_rows__(positives[offer_column]),
+                'negative_user_idx': self.__user_rows__(negatives['user_id']),
+                'negative_offer_idx': self.__offer_rows__(negatives[offer_column]),
+                'negative_indptr': np.concatenate([[0], np.cumsum(n_negatives)]),
+                'n_requests': data['request_id'].nunique()}
+
+
+    def metrics(self,data,ks):
+        """
+        Compute Recall@k and MAP
+
+        Within each mobility request the offers are ranked by their score (ties are won by the offer
+        that appears later in the request), which is the ranking obtained from the pairwise voting
+        with p(i>j) = sigmoid(f_i - f_j). All the requests are scored and ranked at once.
+
+        -Input:
+            data: pandas dataframe containing the data to evaluate (e.i. train set or test set),
+                  or its encoding returned by ranking_data()
+            ks: list containing the different 'k' to evaluate
+
+        -Output:
+            recall_at_k_average: recall@k for each user (averaged over all the mobility requests
+            of each user)
+            MAP: Mean Average Precision for each user (averaged over all the mobility requests
+            of each user)
+            pos_bias_avg: position bias 1/log(1+position) of the chosen offer for each user
+            (averaged over all the mobility requests of each user)
+        """
+        if isinstance(data, pd.DataFrame):
+            data = self.ranking_data(data)
+        user_ids = data['user_ids']
+        n_users = len(user_ids)
+        request_user = data['request_user']
+        n_requests = np.bincount(request_user, minlength=n_users)
+
+        # rank of the chosen offer in each request (only requests with more than one offer)
+        scores = self.__score_pairs__(data['user_idx'], data['offer_idx'])
+        requests = data['requests']
+        position = np.arange(len(requests))
+        order = np.lexsort((-position, -scores, requests))
+        sorted_requests = requests[order]
+        request_start = np.searchsorted(sorted_requests, np.arange(len(request_user)))
+        ranks = np.empty(len(requests), dtype=np.int64)
+        ranks[order] = position - request_start[sorted_requests]
+        n_offers = np.bincount(requests, minlength=len(request_user))
+        chosen = data['positive'] & (n_offers[requests] > 1)
+        chosen_users = request_user[requests[chosen]]
+        chosen_ranks = ranks[chosen]
+
+        recall_at_k_average = dict()
+        MAP = dict.fromkeys(user_ids, 0)
+        pos_bias_avg = dict.fromkeys(user_ids, 0.0)
+        for k in ks:
+            hits = np.bincount(chosen_users[chosen_ranks < k], minlength=n_users)
+            recall_at_k_average[k] = dict(zip(user_ids, hits/n_requests))
+            if k == 5:
+                top = chosen_ranks < k
+                ap = np.bincount(chosen_users[top], weights=1.0/(chosen_ranks[top]+1), minlength=n_users)
+                pos_bias = np.bincount(chosen_users[top], weights=1.0/np.log(1+chosen_ranks[top]+1.0),
+                                       minlength=n_users)
+                MAP = dict(zip(user_ids, ap/n_requests))
+                pos_bias_avg = dict(zip(user_ids, pos_bias/n_requests))
+        return recall_at_k_average, MAP, pos_bias_avg
+
+    def ranking_data(self, data):
+        """
+        Encode a dataset for the ranking metrics, so that it can be evaluated several times
+        without going through the dataframe again
+
+        -Input:
+            data: pandas dataframe containing the data to evaluate (e.i. train set or test set)
+
+        -Output:
+            dictionary of arrays with one entry per distinct offer of each (user, mobility request):
+            requests (request number), user_idx and offer_idx (indices in the parameters, -1 if unknown) and
+            positive (chosen offer), plus user_ids (users in order of appearance) and request_user
+            (user number of each request)
+        """
+        offer_column = self.offer_column
+        offers = data[['user_id','request_id',offer_column]].drop_duplicates()
+        requests = offers.groupby(['user_id','request_id'], sort=False).ngroup().values
+        users, user_ids = pd.factorize(offers['user_id'])
+        request_user = np.empty(requests.max()+1 if len(requests) else 0, dtype=np.int64)
+        request_user[requests] = users
+        chosen_offer = pd.Series(self.requestid_2_offerid_positive).str[0]
+        return {'requests': requests,
+                'user_idx': self.__user_rows__(offers['user_id']),
+                'offer_idx': self.__offer_rows__(offers[offer_column]),
+                'positive': (offers['request_id'].map(chosen_offer) == offers[offer_column]).values,
+                'user_ids': user_ids,
+                'request_user': request_user}
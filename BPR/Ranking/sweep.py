@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+##############################################################################
+# This script runs a hyperparameter sweep (num_components, learning_rate, lmbda) of the BPR models
+
+import argparse
+import importlib
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from bpr_base import EvaluationPolicy
+
+# model shared (read-only) by the workers of the sweep
+_SWEEP_MODEL = None
+
+
+def _init_worker(model):
+    """
+    Initializer of the workers: keep the constructed model (split and index structures)
+    """
+    global _SWEEP_MODEL
+    _SWEEP_MODEL = model
+
+
+def _train_configuration(config):
+    """
+    Train the shared model with one configuration and summarize its final metrics
+    """
+    model = _SWEEP_MODEL
+    model.num_components = config['num_components']
+    np.random.seed(config['seed'])
+    start = time.time()
+    model.fit(single_iterations=config['iterations'], learning_rate=config['learning_rate'],
+              lmbda=config['lmbda'], evaluation=EvaluationPolicy(n_checkpoints=1, ks=config['ks'], verbose=False),
+              **config['fit_kwargs'])
+    result = {'num_components': config['num_components'],
+              'learning_rate': config['learning_rate'],
+              'lmbda': config['lmbda'],
+              'train_time': time.time() - start,
+              'auc_test': model.acu_test[-1],
+              'auc_train': model.acu_train[-1]}
+    # average over users, as done in the notebooks
+    for k in config['ks']:
+        result['recall_at_{}_test'.format(k)] = np.mean(list(model.recall_at_k_test[-1][k].values()))
+    result['MAP_test'] = np.mean(list(model.MAP_test[-1].values()))
+    return result
+
+
+def run_sweep(model, num_components, learning_rates, lmbdas, single_iterations=1e5, n_jobs=None,
+              ks=(1, 5, 10), output=None, seed=0, **fit_kwargs):
+    """
+    Train one BPR model per configuration of the grid and collect the metrics of each one.
+    The model is constructed once (train/test split and index structures) and shared read-only with
+    a pool of worker processes, each one training one configuration at a time.
+    Inputs:
+    - model: constructed BPR model (BPR_MF.BPR or BPR_FM.BPR)
+    - num_components, learning_rates, lmbdas: lists of values of the hyperparameters
+    - single_iterations: number of iterations of each training
+    - n_jobs: number of worker processes (default: number of cores)
+    - ks: list containing the different 'k' to evaluate the Recall@k
+    - output: if given, path of the csv file where the results table is written
+    - seed: seed of the initialization and sampling of every training
+    - fit_kwargs: other arguments of fit (e.g. batch_size for the MF model)
+    Outputs:
+    - results: dataframe with one row per configuration (AUC, Recall@k and MAP on the test set)"""
+    configs = [{'num_components': n, 'learning_rate': lr, 'lmbda': l, 'iterations': single_iterations,
+                'ks': list(ks), 'seed': seed, 'fit_kwargs': fit_kwargs}
+               for n, lr, l in itertools.product(num_components, learning_rates, lmbdas)]
+    # with fork the workers share the memory of the model instead of receiving a copy
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    with context.Pool(processes=n_jobs, initializer=_init_worker, initargs=(model,)) as pool:
+        results = pd.DataFrame(pool.map(_train_configuration, configs, chunksize=1))
+    if output is not None:
+        results.to_csv(output, index=False)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model',
+                        choices=['mf', 'fm'],
+                        default='fm',
+                        help='Underlying model of BPR [default: fm].')
+    parser.add_argument('-d', '--data',
+                        required=True,
+                        help='Csv file with the data to train on.')
+    parser.add_argument('-c', '--num-components',
+                        nargs='+', type=int, default=[5],
+                        help='Dimensions of the latent vectors [default: 5].')
+    parser.add_argument('-l', '--learning-rate',
+                        nargs='+', type=float, default=[0.0005],
+                        help='Learning rates [default: 0.0005].')
+    parser.add_argument('-r', '--lmbda',
+                        nargs='+', type=float, default=[0.01],
+                        help='Regularizers [default: 0.01].')
+    parser.add_argument('-i', '--iterations',
+                        type=float, default=1e5,
+                        help='Iterations of each training [default: 1e5].')
+    parser.add_argument('-j', '--jobs',
+                        type=int, default=None,
+                        help='Number of worker processes [default: number of cores].')
+    parser.add_argument('-o', '--output',
+                        default='sweep_results.csv',
+                        help='Csv file with the results table [default: sweep_results.csv].')
+
+    args = parser.parse_args()
+
+    model_dir = {'mf': 'MF', 'fm': 'FM'}[args.model]
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), model_dir))
+    BPR = importlib.import_module('BPR_{}'.format(model_dir)).BPR
+
+    df = pd.read_csv(args.data, index_col=0).reset_index(drop=True)
+    print('Building the train/test split...', file=sys.stderr, flush=True)
+    reco = BPR(df)
+    results = run_sweep(reco, args.num_components, args.learning_rate, args.lmbda,
+                        single_iterations=args.iterations, n_jobs=args.jobs, output=args.output)
+    print(results)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+##############################################################################
+# This script measures the speed of the duration parsing of the categorizer
+# (isodate against the cached parser of categories/quick.py) on synthetic durations
+# with the format of the offer cache
+
+import argparse
+import time
+from datetime import datetime, timedelta
+import isodate
+import numpy as np
+
+from categories.quick import compute_single_duration, parse_duration_minutes
+
+
+def synthetic_durations(n_durations=100000, n_distinct=2000, max_minutes=1440, seed=0):
+    """
+    Generate durations in the format of the offer cache (see get_time_format)
+    Inputs:
+    - n_durations: number of durations
+    - n_distinct: number of distinct durations (whole minutes, as the durations of the offers and trip legs)
+    - max_minutes: maximum duration in minutes
+    - seed: seed of the generator
+    Outputs:
+    - durations: list of strings"""
+    rng = np.random.RandomState(seed)
+    vocabulary = list()
+    for minutes in rng.randint(0, max_minutes + 1, size=n_distinct):
+        d = datetime(10, 10, 10) + timedelta(minutes=int(minutes))
+        vocabulary.append('P%dY%dM%dDT%dH%dM%dS' % (d.year - 10, d.month - 10, d.day - 10, d.hour, d.minute,
+                                                    d.second))
+    return [vocabulary[i] for i in rng.randint(0, n_distinct, size=n_durations)]
+
+
+def isodate_duration(duration):
+    """Duration in minutes parsed with isodate (previous implementation of compute_single_duration)"""
+    try:
+        timedelta = isodate.parse_duration(duration)
+        minutes = timedelta.days * 1440 + timedelta.seconds * (1 / 60)
+    except isodate.isoerror.ISO8601Error:
+        minutes = 0.0
+    return minutes
+
+
+def measure(function, durations, repeat=3):
+    """Best time (in seconds) of parsing all the durations, and the results"""
+    best = float('inf')
+    for _ in range(repeat):
+        parse_duration_minutes.cache_clear()
+        start = time.perf_counter()
+        results = [function(duration) for duration in durations]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--durations',
+                        default=100000,
+                        type=int,
+                        help='Number of durations to parse [default: 100000].')
+    parser.add_argument('-d', '--distinct',
+                        default=2000,
+                        type=int,
+                        help='Number of distinct durations [default: 2000].')
+    parser.add_argument('-r', '--repeat',
+                        default=3,
+                        type=int,
+                        help='Number of repetitions (the best time is reported) [default: 3].')
+
+    args = parser.parse_args()
+
+    durations = synthetic_durations(args.durations, args.distinct)
+    time_isodate, results_isodate = measure(isodate_duration, durations, args.repeat)
+    time_cached, results_cached = measure(compute_single_duration, durations, args.repeat)
+    assert results_isodate == results_cached, 'the cached parser returns different durations'
+
+    print('{n} durations ({d} distinct)'.format(n=args.durations, d=args.distinct))
+    print('isodate: {:.3f} s ({:.2f} us per duration)'.format(time_isodate, 1e6 * time_isodate / args.durations))
+    print('cached:  {:.3f} s ({:.2f} us per duration)'.format(time_cached, 1e6 * time_cached / args.durations))
+    print('speedup: {:.1f}x'.format(time_isodate / time_cached))
+    print(parse_duration_minutes.cache_info())
@@ -1,5 +1,33 @@
+import functools
+import re
 import isodate
 
+# format of the durations written to the offer cache (see get_time_format), e.g. P0Y0M0DT1H23M0S
+DURATION_FORMAT = re.compile(r'P(\d+)Y(\d+)M(\d+)DT(\d+)H(\d+)M(\d+)S')
+# maximum number of different durations kept in memory
+DURATION_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=DURATION_CACHE_SIZE)
+def parse_duration_minutes(duration):
+    """
+    This function returns a duration in minutes. The durations in the format of the offer cache without years and
+    months are parsed directly, the others with isodate (the results are cached, so each duration is parsed once)
+    - Input: string with the duration in xsd format
+    - Output: duration in minutes (raises isodate.isoerror.ISO8601Error if the duration is not valid)
+    """
+    days_to_minute = 1440
+    seconds_to_minutes = 1 / 60
+    match = DURATION_FORMAT.fullmatch(duration)
+    if match is not None and int(match.group(1)) == 0 and int(match.group(2)) == 0:
+        # same days and seconds (within the day) as the timedelta returned by isodate
+        days, hours, minutes, seconds = (int(value) for value in match.group(3, 4, 5, 6))
+        days, seconds = divmod(days * 86400 + hours * 3600 + minutes * 60 + seconds, 86400)
+    else:
+        timedelta = isodate.parse_duration(duration)
+        days, seconds = timedelta.days, timedelta.seconds
+    return days * days_to_minute + seconds * seconds_to_minutes
+
 
 def compute_duration(durations):
     """
@@ -7,13 +35,10 @@ def compute_duration(durations):
     - Input: dictionary containing the duration of each one of the alternatives
     in the format specified by the offer-cache"""
     durations_minutes = dict()
-    days_to_minute = 1440
-    seconds_to_minutes = 1 / 60
     for key, duration in durations.items():
         # compute duration in minutes
         try:
-            timedelta = isodate.parse_duration(duration)
-            minutes = timedelta.days * days_to_minute + timedelta.seconds * seconds_to_minutes
+            minutes = parse_duration_minutes(duration)
             durations_minutes.setdefault(key, minutes)
         except isodate.isoerror.ISO8601Error:
             durations_minutes = 0.0
@@ -24,11 +49,8 @@ def compute_single_duration(duration):
     """
     - Input: string with the duration in xsd format
     """
-    days_to_minute = 1440
-    seconds_to_minutes = 1 / 60
     try:
-        timedelta = isodate.parse_duration(duration)
-        minutes = timedelta.days * days_to_minute + timedelta.seconds * seconds_to_minutes
+        minutes = parse_duration_minutes(duration)
     except isodate.isoerror.ISO8601Error:
         minutes = 0.0
     return minutes
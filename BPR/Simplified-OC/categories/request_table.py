@@ -0,0 +1,150 @@
+import numpy as np
+
+from categories.quick import compute_single_duration
+from categories.utils.utils import zscore_columns, rod_aggregation_columns, check_if_equal
+
+# raw determinant factors of each offer (columns of the request table)
+FEATURES = ['duration', 'weather', 'complete_total', 'co2', 'distance', 'num_stops', 'n_monuments',
+            'privacy_level', 'seating_quality', 'social', 'fraction_bike_walk', 'length_bike_walk']
+COLUMN = dict(zip(FEATURES, range(len(FEATURES))))
+
+# normalized determinant factors, and whether their weights are flipped (lower values are better)
+NORMALIZED = ['duration', 'weather', 'price', 'distance', 'num_stops', 'walking_distance', 'co2_km',
+              'privacy_level', 'seating_quality', 'n_monuments', 'fraction_bike_walk', 'length_bike_walk']
+NORMALIZED_COLUMN = dict(zip(NORMALIZED, range(len(NORMALIZED))))
+FLIPPED = np.array([True, True, True, True, True, True, True, False, False, False, False, False])
+
+# categories, in the order of the columns of the scores
+CATEGORIES = ['Quick', 'Reliable', 'Cheap', 'Comfortable', 'D2D', 'Env_Friendly', 'Short', 'Multitasking',
+              'Social', 'Panoramic', 'Healthy']
+
+# average speeds (to compute lengths)
+walking_avg_speed = 6 / 60  # in km/min
+bike_avg_speed = 19 / 60  # in km/min
+
+
+def build_request_table(output_offer_level, output_tripleg_level, actual_modes_of_transport, mot_text_to_id):
+    """
+    This function gathers the determinant factors of all the offers of a mobility request in a table
+    Inputs:
+    - output_offer_level, output_tripleg_level: offer and trip leg level data of the request read from the cache
+    - actual_modes_of_transport: list of mot ids of the real trip (to find the offer the user chose)
+    - mot_text_to_id: dictionary from transportation mode to mot id
+    Outputs:
+    - offer_ids: list of offer identifiers (rows of the table)
+    - table: 2-D array with one row per offer and one column per raw determinant factor (see FEATURES)
+    - response: array with 1 for the offer the user chose and 0 for the others
+    """
+    offer_ids = output_offer_level.get('offer_ids', list())
+    # offer-level information, one tuple per offer (first columns of the table)
+    offer_rows = list()
+    response = np.zeros(len(offer_ids), dtype=np.int64)
+    # leg-level information of all the offers, one entry per leg
+    leg_offer = list()
+    leg_privacy_level = list()
+    leg_seating_quality = list()
+    leg_modes = list()
+    leg_durations = list()
+
+    for row, offer_id in enumerate(offer_ids):
+        offer = output_offer_level[offer_id]
+        triplegs = output_tripleg_level[offer_id]
+        co2 = offer['co2']
+        offer_rows.append((compute_single_duration(offer['duration']),
+                           float(offer['weather']),
+                           float(offer['complete_total']['value']),
+                           float(co2) if co2 is not None else 0.0,
+                           float(offer['distance']),
+                           len(triplegs['triplegs']) - 1,
+                           float(offer['n_monuments'])))
+        modes_of_transport = list()
+        for leg_id in triplegs['triplegs']:
+            leg = triplegs[leg_id]
+            leg_offer.append(row)
+            leg_privacy_level.append(float(leg['privacy_level']))
+            leg_seating_quality.append(float(leg['seating_quality']))
+            leg_modes.append(leg['transportation_mode'])
+            leg_durations.append(leg['duration'])
+            modes_of_transport.append(mot_text_to_id[leg['transportation_mode']])
+        # find the alternative the user chose
+        response[row] = check_if_equal(modes_of_transport, actual_modes_of_transport)
+
+    n_offers = len(offer_ids)
+    table = np.zeros((n_offers, len(FEATURES)))
+    if n_offers > 0:
+        table[:, :COLUMN['privacy_level']] = offer_rows
+
+    # aggregate the legs of each offer
+    leg_offer = np.array(leg_offer, dtype=np.int64)
+    leg_modes = np.array(leg_modes, dtype=object)
+    n_legs = np.bincount(leg_offer, minlength=n_offers)
+    is_walk = leg_modes == 'walk'
+    is_cycle = leg_modes == 'cycle'
+    # social: ridesharing?
+    ridesharing = (leg_modes == 'others-drive-car') | (leg_modes == 'bikesharing')
+    # distance done by bike/walk (only the durations of these legs are parsed)
+    speeds = np.where(is_walk, walking_avg_speed, bike_avg_speed)
+    bike_walk_distance = np.array([speed * compute_single_duration(duration) for speed, duration, bike_walk
+                                   in zip(speeds, leg_durations, is_walk | is_cycle) if bike_walk])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table[:, COLUMN['privacy_level']] = np.bincount(leg_offer, weights=leg_privacy_level, minlength=n_offers) / n_legs
+        table[:, COLUMN['seating_quality']] = np.bincount(leg_offer, weights=leg_seating_quality,
+                                                          minlength=n_offers) / n_legs
+        table[:, COLUMN['fraction_bike_walk']] = np.bincount(leg_offer[is_walk | is_cycle], minlength=n_offers) / n_legs
+    table[:, COLUMN['social']] = np.bincount(leg_offer[ridesharing], minlength=n_offers) > 0
+    table[:, COLUMN['length_bike_walk']] = np.bincount(leg_offer[is_walk | is_cycle], weights=bike_walk_distance,
+                                                       minlength=n_offers)
+    return offer_ids, table, response
+
+
+def compute_category_scores(table):
+    """
+    This function computes the score of each category for all the offers of a mobility request at once
+    Inputs:
+    - table: 2-D array returned by build_request_table
+    Outputs:
+    - scores: 2-D array with one row per offer and one column per category (see CATEGORIES)
+    """
+    distance = table[:, COLUMN['distance']]
+    covered = distance != 0
+    # fractions over the distance covered by each offer (0 if the offer covers no distance)
+    safe_distance = np.where(covered, distance, 1.0)
+    co2_km = np.where(covered, table[:, COLUMN['co2']] / safe_distance, 0.0)
+    fraction_length_bike_walk = np.where(covered, table[:, COLUMN['length_bike_walk']] / safe_distance, 0.0)
+
+    # determinant factors normalized at once, one column per factor
+    factors = np.empty((table.shape[0], len(NORMALIZED)))
+    factors[:, NORMALIZED_COLUMN['duration']] = table[:, COLUMN['duration']]
+    factors[:, NORMALIZED_COLUMN['weather']] = table[:, COLUMN['weather']]
+    factors[:, NORMALIZED_COLUMN['price']] = table[:, COLUMN['complete_total']] / 100
+    factors[:, NORMALIZED_COLUMN['distance']] = distance
+    factors[:, NORMALIZED_COLUMN['num_stops']] = table[:, COLUMN['num_stops']]
+    factors[:, NORMALIZED_COLUMN['walking_distance']] = fraction_length_bike_walk
+    factors[:, NORMALIZED_COLUMN['co2_km']] = co2_km
+    factors[:, NORMALIZED_COLUMN['privacy_level']] = table[:, COLUMN['privacy_level']]
+    factors[:, NORMALIZED_COLUMN['seating_quality']] = table[:, COLUMN['seating_quality']]
+    factors[:, NORMALIZED_COLUMN['n_monuments']] = table[:, COLUMN['n_monuments']]
+    factors[:, NORMALIZED_COLUMN['fraction_bike_walk']] = table[:, COLUMN['fraction_bike_walk']]
+    factors[:, NORMALIZED_COLUMN['length_bike_walk']] = fraction_length_bike_walk
+    normalized = zscore_columns(factors, flipped=FLIPPED)
+
+    scores = np.empty((table.shape[0], len(CATEGORIES)))
+    scores[:, 0] = normalized[:, NORMALIZED_COLUMN['duration']]
+    scores[:, 1] = normalized[:, NORMALIZED_COLUMN['weather']]
+    scores[:, 2] = normalized[:, NORMALIZED_COLUMN['price']]
+    # comfortable: seating quality, privacy level and weather (in that order)
+    scores[:, 3] = rod_aggregation_columns(normalized[:, [NORMALIZED_COLUMN['seating_quality'],
+                                                          NORMALIZED_COLUMN['privacy_level'],
+                                                          NORMALIZED_COLUMN['weather']]])
+    scores[:, 4] = normalized[:, NORMALIZED_COLUMN['walking_distance']]
+    scores[:, 5] = normalized[:, NORMALIZED_COLUMN['co2_km']]
+    # short: distance covered, number of stops (in that order)
+    scores[:, 6] = rod_aggregation_columns(normalized[:, [NORMALIZED_COLUMN['distance'],
+                                                          NORMALIZED_COLUMN['num_stops']]])
+    scores[:, 7] = normalized[:, NORMALIZED_COLUMN['privacy_level']]
+    scores[:, 8] = table[:, COLUMN['social']]
+    scores[:, 9] = normalized[:, NORMALIZED_COLUMN['n_monuments']]
+    # healthy: length fraction and leg fraction (in that order)
+    scores[:, 10] = rod_aggregation_columns(normalized[:, [NORMALIZED_COLUMN['length_bike_walk'],
+                                                           NORMALIZED_COLUMN['fraction_bike_walk']]])
+    return scores
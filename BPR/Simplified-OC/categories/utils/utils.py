@@ -1,9 +1,42 @@
-import math
 import numpy as np
 import time
 import redis
 
 
+def zscore_array(values, valid=None, flipped=False):
+    """This function implements the computation of the z-score weights of one or several determinant factors across
+    all offers (the mean and the variance are computed in two passes, over the valid values only).
+    Inputs:
+    - values: 1-D array with one value per offer, or 2-D array with one row per offer and one column per determinant
+    factor
+    - valid: boolean array with the shape of values indicating which values are available (by default, all)
+    - flipped: binary value (or array with one value per column) indicating whether resulting weights need to be
+    flipped (i.e. subtracted from 1)
+    Outputs:
+    - z_scores: array with the z-score values, in the same order as values (nan for the values not available)"""
+    values = np.asarray(values, dtype=np.float64)
+    if valid is None:
+        n = values.shape[0]
+        deviations = values - values.sum(axis=0) / max(n, 1)
+    else:
+        valid = np.asarray(valid, dtype=bool)
+        n = valid.sum(axis=0)
+        values = np.where(valid, values, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            deviations = np.where(valid, values - values.sum(axis=0) / n, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (deviations * deviations).sum(axis=0) / n
+    # factors (almost) constant across the offers get a weight of 0 (also when flipped)
+    constant = ~(variance >= 1e-7)
+    std = np.where(constant, 1.0, np.sqrt(variance))
+    z_scores = deviations / std
+    z_scores = np.where(flipped, 1 - z_scores, z_scores)
+    z_scores = np.where(constant, 0.0, z_scores)
+    if valid is not None:
+        z_scores = np.where(valid, z_scores, np.nan)
+    return z_scores
+
+
 def zscore(offers_dict, flipped=False):
     """This function implements the computation of the z-score weights for a determinant factor across all offers.
     Inputs:
@@ -13,35 +46,26 @@ def zscore(offers_dict, flipped=False):
     Outputs:
     - z_score: dictionary containing z-score values for a determinant factor. Values are identified by offer
     identifiers as keys"""
+    keys = [key for key, value in offers_dict.items() if value is not None]
+    values = np.array([offers_dict[key] for key in keys], dtype=np.float64)
+    return dict(zip(keys, zscore_array(values, flipped=flipped).tolist()))
+
+
+def zscore_columns(values, flipped=False):
+    """This function computes the z-score weights of several determinant factors at once (see zscore_array).
+    Inputs:
+    - values: 2-D array with one row per offer and one column per determinant factor
+    - flipped: binary value (or array with one value per column) indicating whether resulting weights need to be
+    flipped (i.e. subtracted from 1)
+    Outputs:
+    - z_scores: 2-D array with the z-score values, in the same order as values"""
+    return zscore_array(values, flipped=flipped)
 
-    n = 0
-    summation = 0.0
-    sum_square = 0.0
-
-    for value in offers_dict.values():
-        if value is not None:
-            n += 1
-            summation += value
-            sum_square += value * value
-
-    z_scores = dict()
-    if n > 0:
-        average = summation / n
-        variance = sum_square / n - average * average
-        if variance < 1e-7:
-            std = 0.0
-        else:
-            std = math.sqrt(variance)
-        for key, value in offers_dict.items():
-            if value is not None:
-                if std == 0.0:
-                    z_scores.setdefault(key, 0.0)
-                else:
-                    if not flipped:
-                        z_scores.setdefault(key, (value - average) / std)
-                    else:
-                        z_scores.setdefault(key, 1 - (value - average) / std)
-    return z_scores
+
+def rod_aggregation_columns(values):
+    """This function aggregates the normalized values of the features within a category (one column per feature,
+    in order of importance) to compute the category score of each offer (row). The ROD weights are used"""
+    return np.dot(values, np.array(ROD[values.shape[1]]))
 
 
 def check_if_equal(list_1, list_2):
@@ -141,6 +165,92 @@ def extract_data_from_cache(pa_cache, pa_request_id, pa_request_level_items,
     return output_request_level_items, output_offer_level_items, output_tripleg_level_items
 
 
+def extract_data_from_cache_bulk(pa_cache, pa_request_ids, pa_request_level_items,
+                                 pa_offer_level_items, pa_tripleg_level_items):
+    """This is a function to read specific data of many requests from the cache in three pipelined round trips
+    (request level items and offer lists, then leg lists, then all offer and trip leg level items), instead of
+    several round trips per request and per offer.
+    Inputs:
+    - pa_cache: cache identifier
+    - pa_request_ids: list of request ids for which the data should be extracted from cache
+    - pa_request_level_items, pa_offer_level_items, pa_tripleg_level_items: see extract_data_from_cache
+    Outputs:
+    - output: list with the output of extract_data_from_cache for each request id (same order)"""
+    output = [(dict(), dict(), dict()) for _ in pa_request_ids]
+
+    # 1st round trip: request level information and offer lists
+    pipe = pa_cache.pipeline(transaction=False)
+    for request_id in pa_request_ids:
+        for request_level_item in pa_request_level_items:
+            pipe.get('{}:{}'.format(request_id, request_level_item))
+        pipe.lrange('{}:offers'.format(request_id), 0, -1)
+    temp_data = iter(pipe.execute())
+    for output_request_level_items, output_offer_level_items, output_tripleg_level_items in output:
+        for request_level_item in pa_request_level_items:
+            output_request_level_items['{}'.format(request_level_item)] = next(temp_data)
+        output_offer_level_items["offer_ids"] = next(temp_data)
+
+    # 2nd round trip: trip leg lists of all offers
+    if len(pa_tripleg_level_items) > 0:
+        pipe = pa_cache.pipeline(transaction=False)
+        for request_id, (_, output_offer_level_items, _) in zip(pa_request_ids, output):
+            for offer in output_offer_level_items["offer_ids"]:
+                pipe.lrange("{}:{}:legs".format(request_id, offer), 0, -1)
+        temp_data = iter(pipe.execute())
+        for _, output_offer_level_items, output_tripleg_level_items in output:
+            for offer in output_offer_level_items["offer_ids"]:
+                output_tripleg_level_items[offer] = {"triplegs": next(temp_data)}
+
+    # 3rd round trip: offer and trip leg level information
+    pipe = pa_cache.pipeline(transaction=False)
+    for request_id, (_, output_offer_level_items, output_tripleg_level_items) in zip(pa_request_ids, output):
+        for offer in output_offer_level_items["offer_ids"]:
+            for offer_level_item in pa_offer_level_items:
+                temp_key = "{}:{}:{}".format(request_id, offer, offer_level_item)
+                if (offer_level_item == "bookable_total") or (offer_level_item == "complete_total"):
+                    pipe.hgetall(temp_key)
+                else:
+                    pipe.get(temp_key)
+            if len(pa_tripleg_level_items) > 0:
+                for tripleg_id in output_tripleg_level_items[offer]["triplegs"]:
+                    for tripleg_level_item in pa_tripleg_level_items:
+                        pipe.get("{}:{}:{}:{}".format(request_id, offer, tripleg_id, tripleg_level_item))
+    temp_data = iter(pipe.execute())
+    for _, output_offer_level_items, output_tripleg_level_items in output:
+        for offer in output_offer_level_items["offer_ids"]:
+            output_offer_level_items[offer] = dict()
+            for offer_level_item in pa_offer_level_items:
+                output_offer_level_items[offer][offer_level_item] = next(temp_data)
+            if len(pa_tripleg_level_items) > 0:
+                for tripleg_id in output_tripleg_level_items[offer]["triplegs"]:
+                    output_tripleg_level_items[offer][tripleg_id] = dict()
+                    for tripleg_level_item in pa_tripleg_level_items:
+                        output_tripleg_level_items[offer][tripleg_id][tripleg_level_item] = next(temp_data)
+            else:
+                output_tripleg_level_items[offer] = dict()
+
+    return output
+
+
+def read_data_from_cache_bulk_wrapper(pa_cache, pa_request_ids, pa_request_level_items,
+                                      pa_offer_level_items, pa_tripleg_level_items):
+    """Wrapper procedure for the bulk reading operation from cache (see extract_data_from_cache_bulk). Wrapper ensures
+    repeated reading attempts when reading from cache is failing. After a certain number of unsuccessful attempts an
+    error is raised."""
+    retries = 5
+
+    while True:
+        try:
+            return extract_data_from_cache_bulk(pa_cache, pa_request_ids, pa_request_level_items,
+                                                pa_offer_level_items, pa_tripleg_level_items)
+        except redis.exceptions.ConnectionError as exc:
+            print("Reading from cache by a feature collector failed. Retries remaining: {}".format(retries))
+            if retries == 0:
+                raise exc
+            retries -= 1
+            time.sleep(0.1)
+
+
 def read_data_from_cache_wrapper(pa_cache, pa_request_id, pa_request_level_items,
                                  pa_offer_level_items, pa_tripleg_level_items):
     """Wrapper procedure for reading operation from cache used by feature collectors. Wrapper ensures repeated reading
@@ -0,0 +1,144 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+# parquet files are written only if pyarrow is installed (otherwise, csv files)
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ChunkedWriter():
+    """Append-only writer of a table: the rows are collected in preallocated column buffers and each full buffer
+    is written to a new file (chunk) of the output directory, so that the results written so far are kept if the
+    process stops and the table is never copied as it grows."""
+
+    def __init__(self, path, columns, dtypes, chunk_size=50000, file_format=None, resume=False):
+        """
+        Inputs:
+        - path: output directory (the chunks of a previous table in this directory are removed, unless resume)
+        - columns: list of column names
+        - dtypes: list with the dtype of each column (object for strings)
+        - chunk_size: number of rows of each chunk
+        - file_format: 'parquet' or 'csv' (by default, parquet if pyarrow is installed)
+        - resume: keep the chunks of a previous table in this directory and write the new rows after them"""
+        if file_format is None:
+            file_format = 'parquet' if pyarrow is not None else 'csv'
+        if file_format == 'parquet' and pyarrow is None:
+            raise ImportError('pyarrow is needed to write parquet files')
+        self.path = path
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.buffers = dict((column, np.empty(chunk_size, dtype=dtype)) for column, dtype in zip(columns, dtypes))
+        # number of rows in the buffers, number of chunks and total number of rows written
+        self.n_buffered = 0
+        self.n_chunks = 0
+        self.n_rows = 0
+        os.makedirs(path, exist_ok=True)
+        # chunks left incomplete by a process stopped while writing them
+        for temp_file in glob.glob(os.path.join(path, 'part-*.tmp')):
+            os.remove(temp_file)
+        if resume:
+            for chunk in read_chunks(path, columns=self.columns[:1]):
+                self.n_chunks += 1
+                self.n_rows += len(chunk)
+        else:
+            for chunk_file in chunk_files(path):
+                os.remove(chunk_file)
+
+    def truncate(self, n_rows):
+        """Keep only the first n_rows rows of the chunks written (e.g. the rows of the complete results of a previous
+        table, see resume). The rows of the chunk cut are buffered again, so they are written with the next chunk"""
+        if self.n_buffered > 0:
+            raise ValueError('the table can only be truncated before appending new rows')
+        kept_rows = None
+        self.n_chunks = 0
+        self.n_rows = 0
+        for chunk_file in chunk_files(self.path):
+            if kept_rows is None:
+                chunk_rows = len(read_chunk(chunk_file, columns=self.columns[:1]))
+                if self.n_rows + chunk_rows <= n_rows:
+                    self.n_chunks += 1
+                    self.n_rows += chunk_rows
+                    continue
+                kept_rows = read_chunk(chunk_file).iloc[:n_rows - self.n_rows]
+            os.remove(chunk_file)
+        if kept_rows is not None:
+            self.append(**dict((column, kept_rows[column].to_numpy()) for column in self.columns))
+
+    def append(self, **columns):
+        """Append rows to the table. The arguments are arrays (or lists) with the values of each column"""
+        n = len(columns[self.columns[0]])
+        start = 0
+        while start < n:
+            size = min(n - start, self.chunk_size - self.n_buffered)
+            for column in self.columns:
+                self.buffers[column][self.n_buffered:self.n_buffered + size] = columns[column][start:start + size]
+            self.n_buffered += size
+            start += size
+            if self.n_buffered == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """Write the buffered rows to a new chunk"""
+        if self.n_buffered == 0:
+            return
+        chunk = pd.DataFrame(dict((column, self.buffers[column][:self.n_buffered]) for column in self.columns),
+                             index=pd.RangeIndex(self.n_rows, self.n_rows + self.n_buffered))
+        chunk_file = os.path.join(self.path, 'part-{:05d}.{}'.format(self.n_chunks, self.file_format))
+        # the chunk appears only once it is complete
+        temp_file = chunk_file + '.tmp'
+        if self.file_format == 'parquet':
+            chunk.to_parquet(temp_file, engine='pyarrow')
+        else:
+            chunk.to_csv(temp_file)
+        os.replace(temp_file, chunk_file)
+        self.n_chunks += 1
+        self.n_rows += self.n_buffered
+        self.n_buffered = 0
+
+    def close(self):
+        """Write the remaining rows"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def chunk_files(path):
+    """List of the chunks of a table written by ChunkedWriter, in order"""
+    return sorted(glob.glob(os.path.join(path, 'part-*.parquet')) + glob.glob(os.path.join(path, 'part-*.csv')))
+
+
+def read_chunks(path, columns=None):
+    """Read a table written by ChunkedWriter lazily, one chunk at a time.
+    Inputs:
+    - path: directory of the table
+    - columns: list of columns to read (by default, all)
+    Outputs:
+    - generator of dataframes (the index of the rows continues from one chunk to the next)"""
+    for chunk_file in chunk_files(path):
+        yield read_chunk(chunk_file, columns)
+
+
+def read_chunk(chunk_file, columns=None):
+    """Read a single chunk written by ChunkedWriter"""
+    if chunk_file.endswith('.parquet'):
+        return pd.read_parquet(chunk_file, columns=columns)
+    # the floats are parsed back exactly as they were written
+    chunk = pd.read_csv(chunk_file, index_col=0, float_precision='round_trip')
+    return chunk[columns] if columns is not None else chunk
+
+
+def read_table(path, columns=None):
+    """Read a whole table written by ChunkedWriter into a dataframe"""
+    chunks = list(read_chunks(path, columns))
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks)
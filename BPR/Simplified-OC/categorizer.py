@@ -1,233 +1,243 @@
+import argparse
 import configparser as cp
+import multiprocessing
 import redis
 import geojson
 import json
 import numpy as np
 import os
-import pandas as pd
+import sys
 
-from categories.utils.utils import read_data_from_cache_wrapper
-from categories.quick import compute_duration, compute_single_duration
-from categories.cheap import compute_normalized_complete_total
-from categories.co2 import compute_normalized_co2_km
-from categories.healthy import compute_normalized_bike_walk_dist
-from categories.utils.utils import rod_aggregation, zscore, check_if_equal
+from categories.utils.utils import read_data_from_cache_bulk_wrapper
+from categories.request_table import build_request_table, compute_category_scores, CATEGORIES
+from categories.utils.writer import ChunkedWriter, read_chunks
 
 service_name = 'categorizer'
 
-# config
-config = cp.ConfigParser()
-config.read(f'{service_name}.conf')
-
-cache = redis.Redis(host=config.get('cache', 'host'),
-                    port=config.get('cache', 'port'),
-                    decode_responses=True)
-
-# load files containing unique requests ids, mot ids of real trips, and conversion from mot text to id
-base_dir = 'categories/loader'
-filename_request_id = 'unique_request_id.txt'
-filename_tripid_to_mot = 'tripid_to_motid.json'
-filename_mot_text_to_id = 'mote_text_to_motid.json'
-abs_file_requests_id = os.path.join(base_dir, filename_request_id)
-abs_file_tripid_to_mot = os.path.join(base_dir, filename_tripid_to_mot)
-abs_file_mot_text_to_id = os.path.join(base_dir, filename_mot_text_to_id)
-unique_requests_id = open(abs_file_requests_id, 'r').read().split('\n')
-tripid_to_motsid = json.load(open(abs_file_tripid_to_mot))
-mot_text_to_id = json.load(open(abs_file_mot_text_to_id))
-
-# average speeds (to compute lengths)
-walking_avg_speed = 6 / 60  # in km/min
-bike_avg_speed = 19 / 60  # in km/min
-
-# create an empty dataframe to store the results
-df = pd.DataFrame()
-df_request_id = pd.DataFrame()
-
-# create list to store requests whose solutions the user did not choose
-request_id_no_solution = list()
-
-k = 1
 NPRINT = 100
-for request_id in unique_requests_id[0:5000]:
-
-    # request_id = '#30:10002'
-    # user_id = cache.get('{request_id}:user_id'.format(request_id=request_id))
-
-    output_request_level, \
-    output_offer_level, \
-    output_tripleg_level = read_data_from_cache_wrapper(pa_cache=cache, pa_request_id=request_id,
-                                                        pa_request_level_items=['user_id', 'from_lat', 'from_lon',
-                                                                                'to_lat', 'to_lon'],
-                                                        pa_offer_level_items=['duration', 'weather', 'complete_total',
-                                                                              'co2',
-                                                                              'distance',
-                                                                              'n_monuments'],
-                                                        pa_tripleg_level_items=['privacy_level',
-                                                                                'seating_quality',
-                                                                                'transportation_mode',
-                                                                                'leg_stops',
-                                                                                'duration'])
-    user_id = output_request_level['user_id']
-    actual_modes_of_transport = tripid_to_motsid[request_id]
-
-    # dictionaries to store results
-    offer_durations_xsd = dict()
-    offer_weather = dict()
-    offer_co2 = dict()
-    offer_distance_covered = dict()
-    offer_num_stops = dict()
-    offer_complete_total = dict()
-    offer_privacy_level = dict()
-    offer_seating_quality = dict()
-    offer_n_monuments = dict()
-    offer_social = dict()
-    offer_fraction_bike_walk = dict()
-    offer_length_bike_walking = dict()
-    offer_response = dict()
-
-    if 'offer_ids' in output_offer_level.keys():
-        # offer-level information
-        for offer_id in output_offer_level['offer_ids']:
-            # dictionary of durations (quick category)
-            offer_durations_xsd.setdefault(offer_id, output_offer_level[offer_id]['duration'])
-            # dictionary of prob_delay because of weather (reliable category)
-            offer_weather.setdefault(offer_id, float(output_offer_level[offer_id]['weather']))
-            # dictionary of co2 emissions (environmentally friendly category)
-            offer_co2.setdefault(offer_id, output_offer_level[offer_id]['co2'])
-            # dictionary of total price (cheap category)
-            offer_complete_total.setdefault(offer_id, output_offer_level[offer_id]['complete_total']['value'])
-            # dictionary of distance covered (short category)
-            offer_distance_covered.setdefault(offer_id, float(output_offer_level[offer_id]['distance']))
-            # dictionary of number of stops (short category)
-            offer_num_stops.setdefault(offer_id, len(output_tripleg_level[offer_id]['triplegs']) - 1)
-            # dictionary of number of monuments
-            offer_n_monuments.setdefault(offer_id, float(output_offer_level[offer_id]['n_monuments']))
-            # list of privacy level (multitasking and comfortable category)
-            offer_privacy_level_list = list()
-            # list of seating quality (comfortable category)
-            offer_seating_quality_list = list()
-            # variables to store the number of legs done by bike/walk and distance
-            legs_bike_walk = 0
-            distance_bike_walk = 0.0
-            # modes of transport (to find the actual response)
-            modes_of_transport = list()
-
-            # leg-level information
-            if 'triplegs' in output_tripleg_level[offer_id].keys():
-
-                # total number of legs
-                n_legs = len(output_tripleg_level[offer_id]['triplegs'])
-
-                # social: ridesharing?
-                ridesharing = 0
-
-                for leg_id in output_tripleg_level[offer_id]['triplegs']:
-                    # privacy level
-                    offer_privacy_level_list.append(float(output_tripleg_level[offer_id][leg_id]['privacy_level']))
-                    # seating quality
-                    offer_seating_quality_list.append(float(output_tripleg_level[offer_id][leg_id]['seating_quality']))
-                    # social: ridesharing?
-                    if output_tripleg_level[offer_id][leg_id]['transportation_mode'] in ['others-drive-car',
-                                                                                         'bikesharing']:
-                        ridesharing = 1
-
-                    # legs done by bike/walk (healthy and d2d)
-                    if output_tripleg_level[offer_id][leg_id]['transportation_mode'] in ['cycle', 'walk']:
-                        legs_bike_walk += 1
-                        if output_tripleg_level[offer_id][leg_id]['transportation_mode'] == 'walk':
-                            distance_bike_walk += walking_avg_speed * compute_single_duration(
-                                output_tripleg_level[offer_id][leg_id]['duration']
-                            )
-
-                        if output_tripleg_level[offer_id][leg_id]['transportation_mode'] == 'cycle':
-                            distance_bike_walk += bike_avg_speed * compute_single_duration(
-                                output_tripleg_level[offer_id][leg_id]['duration']
-                            )
-
-                    modes_of_transport.append(mot_text_to_id[
-                                                  output_tripleg_level[offer_id][leg_id]['transportation_mode']])
-
-                offer_privacy_level.setdefault(offer_id, np.mean(offer_privacy_level_list))
-                offer_seating_quality.setdefault(offer_id, np.mean(offer_seating_quality_list))
-                offer_social.setdefault(offer_id, ridesharing)
-                offer_fraction_bike_walk.setdefault(offer_id,
-                                                    legs_bike_walk / len(output_tripleg_level[offer_id]['triplegs']))
-                offer_length_bike_walking.setdefault(offer_id, distance_bike_walk)
-
-                # find the alternative the user chose
-                offer_response.setdefault(offer_id, check_if_equal(modes_of_transport, actual_modes_of_transport))
-    if np.sum(list(offer_response.values())) == 0:
-        request_id_no_solution.append(request_id)
-    # normalize each feature
-    # compute normalized duration
-    offer_durations_normalized = zscore(compute_duration(offer_durations_xsd), flipped=True)
-    # compute normalized weather
-    offer_weather_normalized = zscore(offer_weather, flipped=True)
-    # compute normalized price
-    offer_complete_total_normalized = compute_normalized_complete_total(offer_complete_total)
-    # compute normalized distance covered
-    offer_distance_covered_normalized = zscore(offer_distance_covered, flipped=True)
-    # compute normalized number of stops
-    offer_num_stops_normalized = zscore(offer_num_stops, flipped=True)
-    # compute normalized walking/biking distance (d2d)
-    offer_walking_distance_normalized = compute_normalized_bike_walk_dist(offer_length_bike_walking,
-                                                                          offer_distance_covered, flipped=True)
-    # compute normalized co2 per km
-    offer_co2_km_normalized = compute_normalized_co2_km(offer_co2, offer_distance_covered)
-    # compute normalized privacy level
-    offer_privacy_level_normalized = zscore(offer_privacy_level)
-    # compute normalized seating quality
-    offer_seating_quality_normalized = zscore(offer_seating_quality)
-    # compute normalized number of monuments
-    offer_n_monuments_normalized = zscore(offer_n_monuments)
-    # compute normalized fraction of trip done by walk/bike
-    offer_fraction_bike_walk_normalized = zscore(offer_fraction_bike_walk)
-    # compute normalized length fraction of trip done by walk/bike (healthy)
-    offer_length_bike_walking_normalized = compute_normalized_bike_walk_dist(offer_length_bike_walking,
-                                                                             offer_distance_covered)
-
-    # compute scores of each category
-    # comfortable: seating quality, privacy level and weather (in that order)
-    comfortable_dict = dict([(k, [offer_seating_quality_normalized[k],
-                                  offer_privacy_level_normalized[k],
-                                  offer_weather_normalized[k]]) for k in offer_seating_quality_normalized])
-    comfortable_scores = rod_aggregation(comfortable_dict)
-
-    # short: distance covered, number of stops (in that order)
-    short_dict = dict([(k, [offer_distance_covered_normalized[k],
-                            offer_num_stops_normalized[k]]) for k in offer_distance_covered_normalized])
-    short_scores = rod_aggregation(short_dict)
-
-    # healthy: length fraction and leg fraction (in that order)
-    healthy_dict = dict([(k, [offer_length_bike_walking_normalized[k],
-                              offer_fraction_bike_walk_normalized[k]]) for k in offer_distance_covered_normalized])
-    healthy_scores = rod_aggregation(healthy_dict)
-
-    # store all scores in the same dictionary
-    offer_scores = dict([(k, [user_id, offer_durations_normalized[k], offer_weather_normalized[k],
-                              offer_complete_total_normalized[k], comfortable_scores[k],
-                              offer_walking_distance_normalized[k], offer_co2_km_normalized[k],
-                              short_scores[k], offer_privacy_level_normalized[k], offer_social[k],
-                              offer_n_monuments_normalized[k], healthy_scores[k], offer_response[k]])
-                         for k in offer_seating_quality_normalized])
-
-    df = pd.concat([df, pd.DataFrame.from_dict(offer_scores, orient='index')])
-    df_request_id = pd.concat([df_request_id, pd.DataFrame(len(offer_scores) * [request_id])])
-    if k % NPRINT == 0:
-        print('{k} trips categorized'.format(k=k))
-    k += 1
-
-df = pd.concat([df_request_id.reset_index().rename(columns={0: 'request_id'}),
-                df.reset_index().rename(columns={'index': 'offer_id'})], axis=1)
-
-# drop unnecessary columns
-df = df.drop(columns=['index'])
-# rename columns
-df = df.rename(columns={0: 'user_id', 1: 'Quick', 2: 'Reliable', 3: 'Cheap',
-                        4: 'Comfortable', 5: 'D2D', 6: 'Env_Friendly', 7: 'Short', 8: 'Multitasking',
-                        9: 'Social', 10: 'Panoramic', 11: 'Healthy', 12: 'Response'})
-print(df)
-print(df.Response.sum())
-# print(request_id_no_solution)
-np.savetxt('categories/data/request_id_no_solution_5000.txt', request_id_no_solution, fmt='%s')
-df.to_csv('categories/data/df_combined_5000.csv')
+# number of requests read from the cache at once
+WINDOW = 100
+
+# columns of the results and their types
+COLUMNS = ['request_id', 'offer_id', 'user_id'] + CATEGORIES + ['Response']
+DTYPES = [object, object, object] + [int if category == 'Social' else np.float64 for category in CATEGORIES] + [int]
+
+# connection and data of the process (set by init_worker)
+cache = None
+tripid_to_motsid = None
+mot_text_to_id = None
+
+
+def init_worker(host, port, pa_tripid_to_motsid, pa_mot_text_to_id):
+    """Initializer of each process categorizing requests: every process opens its own connection to the cache"""
+    global cache, tripid_to_motsid, mot_text_to_id
+    cache = redis.Redis(host=host, port=port, decode_responses=True)
+    tripid_to_motsid = pa_tripid_to_motsid
+    mot_text_to_id = pa_mot_text_to_id
+
+
+def categorize_requests(requests_id, window=WINDOW):
+    """This function computes the score of each category for all the offers of the given requests.
+    Inputs:
+    - requests_id: list of request ids
+    - window: number of requests read from the cache at once
+    Outputs:
+    - results: dictionary with the values of each column of the results (see COLUMNS), one row per offer
+    - request_id_no_solution: list of requests whose solutions the user did not choose"""
+    # lists to store the results of each request (concatenated at the end)
+    requests_column = list()
+    offers_column = list()
+    users_column = list()
+    scores = list()
+    responses = list()
+
+    # create list to store requests whose solutions the user did not choose
+    request_id_no_solution = list()
+
+    for window_start in range(0, len(requests_id), window):
+        window_requests = requests_id[window_start:window_start + window]
+        output_window = read_data_from_cache_bulk_wrapper(pa_cache=cache, pa_request_ids=window_requests,
+                                                          pa_request_level_items=['user_id', 'from_lat', 'from_lon',
+                                                                                  'to_lat', 'to_lon'],
+                                                          pa_offer_level_items=['duration', 'weather',
+                                                                                'complete_total',
+                                                                                'co2',
+                                                                                'distance',
+                                                                                'n_monuments'],
+                                                          pa_tripleg_level_items=['privacy_level',
+                                                                                  'seating_quality',
+                                                                                  'transportation_mode',
+                                                                                  'leg_stops',
+                                                                                  'duration'])
+        for request_id, (output_request_level, output_offer_level, output_tripleg_level) in zip(window_requests,
+                                                                                                output_window):
+            user_id = output_request_level['user_id']
+            actual_modes_of_transport = tripid_to_motsid[request_id]
+
+            # table with the determinant factors of all offers (one row per offer)
+            offer_ids, request_table, offer_response = build_request_table(output_offer_level, output_tripleg_level,
+                                                                           actual_modes_of_transport, mot_text_to_id)
+            if np.sum(offer_response) == 0:
+                request_id_no_solution.append(request_id)
+
+            # normalize all features and compute the scores of each category at once
+            scores.append(compute_category_scores(request_table))
+            requests_column.extend([request_id] * len(offer_ids))
+            offers_column.extend(offer_ids)
+            users_column.extend([user_id] * len(offer_ids))
+            responses.append(offer_response)
+
+    scores = np.concatenate(scores) if len(scores) > 0 else np.empty((0, len(CATEGORIES)))
+    results = {'request_id': requests_column, 'offer_id': offers_column, 'user_id': users_column,
+               'Response': np.concatenate(responses) if len(responses) > 0 else np.empty(0, dtype=int)}
+    for c, category in enumerate(CATEGORIES):
+        results[category] = scores[:, c]
+    return results, request_id_no_solution
+
+
+def categorize_shard(shard):
+    """Categorize a shard (range of requests) in a worker process. Returns the shard number with the results"""
+    shard_index, requests_id, window = shard
+    results, request_id_no_solution = categorize_requests(requests_id, window)
+    return shard_index, len(requests_id), results, request_id_no_solution
+
+
+def completed_shards(results_dir, requests_id, shard_size):
+    """Shards whose results were completely written by a previous run (see --resume). The last request written may
+    be incomplete, so its shard is categorized again.
+    Inputs:
+    - results_dir: directory of the chunks of the results
+    - requests_id: list of request ids to categorize
+    - shard_size: number of requests of each shard
+    Outputs:
+    - n_shards: number of complete shards, from the first one
+    - n_rows: number of rows of the complete shards (the first rows of the results)
+    - request_id_no_solution: list of requests of the complete shards whose solutions the user did not choose
+    - n_responses: number of offers chosen in the complete shards"""
+    position = dict((request_id, p) for p, request_id in enumerate(requests_id))
+    positions = list()
+    responses = list()
+    for chunk in read_chunks(results_dir, columns=['request_id', 'Response']):
+        chunk_requests = chunk['request_id'].astype(str)
+        unknown = ~chunk_requests.isin(position)
+        if unknown.any():
+            raise ValueError('request {} of the results is not in the requests to categorize'
+                             .format(chunk_requests[unknown].iloc[0]))
+        positions.append(chunk_requests.map(position).to_numpy(dtype=np.int64))
+        responses.append(chunk['Response'].to_numpy())
+    if len(positions) == 0:
+        return 0, 0, list(), 0
+    positions = np.concatenate(positions)
+    responses = np.concatenate(responses)
+    n_shards = positions.max() // shard_size
+    complete = positions < n_shards * shard_size
+    # requests with an offer chosen (the requests without offers have no rows)
+    answered = np.zeros(n_shards * shard_size, dtype=bool)
+    answered[positions[complete & (responses > 0)]] = True
+    request_id_no_solution = [requests_id[p] for p in np.flatnonzero(~answered)]
+    return int(n_shards), int(np.sum(complete)), request_id_no_solution, np.sum(responses[complete])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests',
+                        default=5000,
+                        type=int,
+                        help='Number of requests to categorize, from the beginning of the list [default: 5000].')
+    parser.add_argument('-j', '--jobs',
+                        default=1,
+                        type=int,
+                        help='Number of worker processes, each one categorizing disjoint shards of requests '
+                             '[default: 1].')
+    parser.add_argument('-s', '--shard-size',
+                        default=500,
+                        type=int,
+                        help='Number of requests of each shard [default: 500].')
+    parser.add_argument('-c', '--chunk-size',
+                        default=50000,
+                        type=int,
+                        help='Number of rows of each chunk of the results [default: 50000].')
+    parser.add_argument('-w', '--window',
+                        default=WINDOW,
+                        type=int,
+                        help='Number of requests read from the cache at once [default: {}].'.format(WINDOW))
+    parser.add_argument('-r', '--resume',
+                        action='store_true',
+                        help='Keep the results written by a previous run with the same number of requests and '
+                             'categorize only the shards they do not cover.')
+
+    args = parser.parse_args()
+
+    # config
+    config = cp.ConfigParser()
+    config.read(f'{service_name}.conf')
+    host = config.get('cache', 'host')
+    port = config.get('cache', 'port')
+
+    # load files containing unique requests ids, mot ids of real trips, and conversion from mot text to id
+    base_dir = 'categories/loader'
+    filename_request_id = 'unique_request_id.txt'
+    filename_tripid_to_mot = 'tripid_to_motid.json'
+    filename_mot_text_to_id = 'mote_text_to_motid.json'
+    abs_file_requests_id = os.path.join(base_dir, filename_request_id)
+    abs_file_tripid_to_mot = os.path.join(base_dir, filename_tripid_to_mot)
+    abs_file_mot_text_to_id = os.path.join(base_dir, filename_mot_text_to_id)
+    unique_requests_id = open(abs_file_requests_id, 'r').read().split('\n')
+    requests_id = unique_requests_id[0:args.requests]
+    worker_args = (host, port, json.load(open(abs_file_tripid_to_mot)), json.load(open(abs_file_mot_text_to_id)))
+
+    # disjoint shards of consecutive requests
+    shards = [(shard_index, requests_id[start:start + args.shard_size], args.window)
+              for shard_index, start in enumerate(range(0, len(requests_id), args.shard_size))]
+
+    # the results are written in chunks as the shards are categorized, in the order of the requests
+    results_dir = 'categories/data/df_combined_{}'.format(args.requests)
+    writer = ChunkedWriter(results_dir, COLUMNS, DTYPES, chunk_size=args.chunk_size, resume=args.resume)
+    if args.resume:
+        next_shard, n_rows, request_id_no_solution, n_responses = completed_shards(results_dir, requests_id,
+                                                                                   args.shard_size)
+        writer.truncate(n_rows)
+        print("Resuming after {shards} shards ({rows} offers) categorized by a previous run"
+              .format(shards=next_shard, rows=n_rows), file=sys.stderr, flush=True)
+    else:
+        next_shard, request_id_no_solution, n_responses = 0, list(), 0
+    k = min(next_shard * args.shard_size, len(requests_id))
+    shards = shards[next_shard:]
+
+    print("Categorizing {n} requests in {shards} shards with {jobs} processes..."
+          .format(n=len(requests_id) - k, shards=len(shards), jobs=args.jobs),
+          file=sys.stderr, flush=True)
+    # results of shards categorized before a previous one (written once all the previous shards are written)
+    pending = dict()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(processes=args.jobs, initializer=init_worker, initargs=worker_args)
+        shard_results = pool.imap_unordered(categorize_shard, shards)
+    else:
+        pool = None
+        init_worker(*worker_args)
+        shard_results = map(categorize_shard, shards)
+    for shard_index, n_requests, shard_results_columns, shard_no_solution in shard_results:
+        pending[shard_index] = (shard_results_columns, shard_no_solution)
+        while next_shard in pending:
+            shard_results_columns, shard_no_solution = pending.pop(next_shard)
+            writer.append(**shard_results_columns)
+            request_id_no_solution.extend(shard_no_solution)
+            n_responses += np.sum(shard_results_columns['Response'])
+            next_shard += 1
+        if (k + n_requests) // NPRINT > k // NPRINT:
+            print('{k} trips categorized'.format(k=k + n_requests))
+        k += n_requests
+    if pool is not None:
+        pool.close()
+        pool.join()
+    writer.close()
+
+    print('{n} offers categorized'.format(n=writer.n_rows))
+    print(n_responses)
+    # print(request_id_no_solution)
+    np.savetxt('categories/data/request_id_no_solution_{}.txt'.format(args.requests), request_id_no_solution,
+               fmt='%s')
+    # single csv file with all the results, written chunk by chunk
+    with open('categories/data/df_combined_{}.csv'.format(args.requests), 'w') as f:
+        for i, chunk in enumerate(read_chunks(results_dir)):
+            chunk.to_csv(f, header=(i == 0))